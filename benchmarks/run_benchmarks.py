@@ -0,0 +1,183 @@
+"""
+Benchmark Suite for the KMC hot path, trajectory sampling and coarse-graining
+Also times the import of the simulation-only modules in a fresh interpreter against IMPORT_BUDGET.
+Results are printed and written as JSON so throughput can be compared across releases, e.g.
+    python benchmarks/run_benchmarks.py --output bench.json
+    python benchmarks/run_benchmarks.py --quick
+Written by: Amro Dodin
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import kmcGrid.kmc as kmc
+import kmcGrid.sample as smp
+from kmcGrid.lattice import SCLattice, k_B
+
+T = 300
+
+# Modules a simulation-only worker process imports, the seconds they may take, and what they must not pull in
+SIMULATION_MODULES = ('kmcGrid.kmc', 'kmcGrid.lattice', 'kmcGrid.parallel')
+IMPORT_BUDGET = 0.5
+HEAVY_MODULES = ('matplotlib', 'scipy')
+
+
+def best_time(function, repeats):
+    """ Best wall time in seconds of repeats calls to function along with the last return value """
+    best = np.inf
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def center(size):
+    return tuple(int(s / 2) for s in size)
+
+
+def bench_step(sizes, n_hops, repeats):
+    """ Hops per second of repeated kmc.step calls """
+    records = []
+    for size in sizes:
+        lattice = SCLattice(size, k_B * T, 1.0, T)
+        rng = np.random.default_rng(0)
+        start_site = lattice.state_to_index(center(size))
+
+        def hop():
+            site = start_site
+            for _ in range(n_hops):
+                site, dt = kmc.step(site, lattice, rng)
+
+        seconds, _ = best_time(hop, repeats)
+        records.append({'benchmark': 'kmc.step', 'size': list(size), 'dim': len(size), 'hops': n_hops,
+                        'seconds': seconds, 'hops_per_second': n_hops / seconds})
+    return records
+
+
+def bench_run(sizes, tau, repeats):
+    """ Hops per second of single trajectory kmc.run """
+    records = []
+    for size in sizes:
+        lattice = SCLattice(size, k_B * T, 1.0, T)
+        rng = np.random.default_rng(0)
+        seconds, (states, times) = best_time(lambda: kmc.run(center(size), lattice, tau, rng), repeats)
+        hops = len(states) - 1
+        records.append({'benchmark': 'kmc.run', 'size': list(size), 'dim': len(size), 'tau': tau, 'hops': hops,
+                        'seconds': seconds, 'hops_per_second': hops / seconds})
+    return records
+
+
+def bench_run_ensemble(sizes, tau, n_walkers, repeats):
+    """ Hops per second of lockstep kmc.run_ensemble """
+    records = []
+    for size in sizes:
+        lattice = SCLattice(size, k_B * T, 1.0, T)
+        rng = np.random.default_rng(0)
+        seconds, packed = best_time(lambda: kmc.run_ensemble(center(size), lattice, tau, n_walkers, rng,
+                                                             packed=True), repeats)
+        hops = len(packed.times) - n_walkers
+        records.append({'benchmark': 'kmc.run_ensemble', 'size': list(size), 'dim': len(size), 'tau': tau,
+                        'n_walkers': n_walkers, 'hops': hops, 'seconds': seconds, 'hops_per_second': hops / seconds})
+    return records
+
+
+def bench_sampling(n_trajs, n_targets_list, tau, repeats):
+    """ Seconds per call of sample_trajectories and sample_observable (via sample_msd) on trajectory lists """
+    records = []
+    size = (100, 100)
+    s0 = center(size)
+    lattice = SCLattice(size, k_B * T, 1.0, T)
+    for n_traj in n_trajs:
+        states, times = kmc.run_ensemble(s0, lattice, tau, n_traj, np.random.default_rng(0))
+        for n_targets in n_targets_list:
+            target_times = np.linspace(0, tau, n_targets)
+            seconds, _ = best_time(lambda: smp.sample_trajectories(states, times, target_times, lattice), repeats)
+            records.append({'benchmark': 'sample.sample_trajectories', 'n_traj': n_traj, 'n_targets': n_targets,
+                            'seconds': seconds})
+            seconds, _ = best_time(lambda: smp.sample_msd(s0, states, times, target_times), repeats)
+            records.append({'benchmark': 'sample.sample_observable', 'n_traj': n_traj, 'n_targets': n_targets,
+                            'seconds': seconds})
+    return records
+
+
+def bench_coarse_grain(sizes, factor, repeats):
+    """ Seconds per call of SCLattice.two_dim_coarse_grain reducing each axis by factor """
+    records = []
+    for size in sizes:
+        lattice = SCLattice(size, k_B * T, 1.0, T)
+        energy = lattice.energy
+        new_size = tuple(int(s / factor) for s in size)
+
+        def coarse_grain():
+            lattice.energy = energy
+            lattice.size = size
+            lattice.two_dim_coarse_grain(new_size)
+
+        seconds, _ = best_time(coarse_grain, repeats)
+        records.append({'benchmark': 'lattice.two_dim_coarse_grain', 'size': list(size), 'new_size': list(new_size),
+                        'seconds': seconds})
+    return records
+
+
+def bench_import(repeats):
+    """ Seconds to import SIMULATION_MODULES in a fresh interpreter and any heavy modules they loaded """
+    script = ('import json, sys, time; start = time.perf_counter(); import ' + ', '.join(SIMULATION_MODULES) +
+              '; print(json.dumps([time.perf_counter() - start, [m for m in ' + repr(HEAVY_MODULES) +
+              ' if m in sys.modules]]))')
+    best = np.inf
+    for _ in range(repeats):
+        seconds, heavy = json.loads(subprocess.run([sys.executable, '-c', script], capture_output=True,
+                                                   check=True, text=True).stdout)
+        best = min(best, seconds)
+    return [{'benchmark': 'import', 'modules': list(SIMULATION_MODULES), 'seconds': best, 'budget': IMPORT_BUDGET,
+             'heavy_modules': heavy, 'within_budget': best <= IMPORT_BUDGET and not heavy}]
+
+
+def run_all(quick=False):
+    repeats = 1 if quick else 3
+    if quick:
+        sizes = [(100,), (100, 100), (20, 20, 20)]
+        grids = [(100, 100), (200, 200)]
+        n_trajs = [100, 1000]
+        n_targets_list = [40, 400]
+    else:
+        sizes = [(1000,), (100, 100), (1000, 1000), (20, 20, 20), (100, 100, 100)]
+        grids = [(100, 100), (500, 500), (1000, 1000)]
+        n_trajs = [1000, 10000]
+        n_targets_list = [40, 400, 2000]
+    records = []
+    records += bench_import(repeats)
+    records += bench_step(sizes, 2000 if quick else 20000, repeats)
+    records += bench_run(sizes, 500. if quick else 5000., repeats)
+    records += bench_run_ensemble(sizes, 3., 500 if quick else 5000, repeats)
+    records += bench_sampling(n_trajs, n_targets_list, 3., repeats)
+    records += bench_coarse_grain(grids, 2, repeats)
+    return records
+
+
+def environment():
+    return {'timestamp': datetime.datetime.now().isoformat(), 'python': platform.python_version(),
+            'numpy': np.__version__, 'machine': platform.machine(), 'platform': platform.platform()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='JSON file to write results to')
+    parser.add_argument('--quick', action='store_true', help='small sizes for a fast smoke run')
+    args = parser.parse_args()
+
+    results = {'environment': environment(), 'results': run_all(args.quick)}
+    for record in results['results']:
+        print(json.dumps(record))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -7,6 +7,7 @@ import kmcGrid.lattice
 import kmcGrid.kmc
 import kmcGrid.animate
 import numpy as np
+from kmcGrid.instrument import ProgressReporter, RunStats
 
 # Grid Parameters
 T = 300
@@ -27,10 +28,11 @@ t_traj = []
 target_times = np.linspace(0, t_max, n_plot)
 
 # Run Simulations
+stats = RunStats(time_phases=False)
+progress = ProgressReporter(num_traj)
 for i in range(num_traj):
-    print(str(i + 1) + '/' + str(num_traj))
     lattice.shuffle()
-    states, times = kmcGrid.kmc.run(s0, lattice, t_max)
+    states, times = kmcGrid.kmc.run(s0, lattice, t_max, stats=stats, callback=progress)
     s_traj.append(states)
     t_traj.append(times)
 
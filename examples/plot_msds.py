@@ -1,11 +1,11 @@
 """
 Generates <MSD> vs time plots and (optionally) calculates instantaneous diffusion constants
+All disorder strengths are run as one parameter sweep sharing a single process pool
 """
 
 import kmcGrid.lattice
-import kmcGrid.kmc
 import kmcGrid.plot as plot
-import kmcGrid.animate as animate
+import kmcGrid.sweep as sweep
 import numpy as np
 
 # Grid Parameters
@@ -18,102 +18,15 @@ num_traj = 50000
 t_max = 3.
 n_plot = 2000
 
-sig = 0.01
+sigs = [0.01, .5, 1., 2., 3.]
 
-# Build Lattice
-lattice = kmcGrid.lattice.SCLattice((100, 100), sig * kmcGrid.lattice.k_B* T, 1.0, T)
-
-# Build Simulation Arrays
-s_traj = []
-t_traj = []
-target_times = np.linspace(0, t_max, n_plot)
-
-# Run Simulations
-for i in range(num_traj):
-    print(str(i + 1) + '/' + str(num_traj))
-    lattice.shuffle()
-    states, times = kmcGrid.kmc.run(s0, lattice, t_max)
-    s_traj.append(states)
-    t_traj.append(times)
-
-ax_mean, ax_slope = plot.plot_mean_msd(s0, s_traj, t_traj, target_times, 50)
-
-sig = .5
-
-# Build Lattice
-lattice = kmcGrid.lattice.SCLattice((100, 100), sig * kmcGrid.lattice.k_B* T, 1.0, T)
-
-# Build Simulation Arrays
-s_traj = []
-t_traj = []
-target_times = np.linspace(0, t_max, n_plot)
-
-# Run Simulations
-for i in range(num_traj):
-    print(str(i + 1) + '/' + str(num_traj))
-    lattice.shuffle()
-    states, times = kmcGrid.kmc.run(s0, lattice, t_max)
-    s_traj.append(states)
-    t_traj.append(times)
-
-ax_mean, ax_slope = plot.plot_mean_msd(s0, s_traj, t_traj, target_times, 50, target_axes=(ax_mean, ax_slope))
-
-sig = 1.
-
-# Build Lattice
-lattice = kmcGrid.lattice.SCLattice((100, 100), sig * kmcGrid.lattice.k_B* T, 1.0, T)
-
-# Build Simulation Arrays
-s_traj = []
-t_traj = []
-target_times = np.linspace(0, t_max, n_plot)
-
-# Run Simulations
-for i in range(num_traj):
-    print(str(i + 1) + '/' + str(num_traj))
-    lattice.shuffle()
-    states, times = kmcGrid.kmc.run(s0, lattice, t_max)
-    s_traj.append(states)
-    t_traj.append(times)
-
-ax_mean, ax_slope = plot.plot_mean_msd(s0, s_traj, t_traj, target_times, 50, target_axes=(ax_mean, ax_slope))
-
-sig = 2.
-
-# Build Lattice
-lattice = kmcGrid.lattice.SCLattice((100, 100), sig * kmcGrid.lattice.k_B* T, 1.0, T)
-
-# Build Simulation Arrays
-s_traj = []
-t_traj = []
-target_times = np.linspace(0, t_max, n_plot)
-
-# Run Simulations
-for i in range(num_traj):
-    print(str(i + 1) + '/' + str(num_traj))
-    lattice.shuffle()
-    states, times = kmcGrid.kmc.run(s0, lattice, t_max)
-    s_traj.append(states)
-    t_traj.append(times)
-
-ax_mean, ax_slope = plot.plot_mean_msd(s0, s_traj, t_traj, target_times, 50, target_axes=(ax_mean, ax_slope))
-
-sig = 3.
-
-# Build Lattice
-lattice = kmcGrid.lattice.SCLattice((100, 100), sig * kmcGrid.lattice.k_B* T, 1.0, T)
-
-# Build Simulation Arrays
-s_traj = []
-t_traj = []
+# Build Parameter Grid
+points = sweep.parameter_grid([sig * kmcGrid.lattice.k_B * T for sig in sigs], [T], [1.0], [grid_size])
 target_times = np.linspace(0, t_max, n_plot)
 
-# Run Simulations
-for i in range(num_traj):
-    print(str(i + 1) + '/' + str(num_traj))
-    lattice.shuffle()
-    states, times = kmcGrid.kmc.run(s0, lattice, t_max)
-    s_traj.append(states)
-    t_traj.append(times)
+# The sweep starts a process pool, which re-imports this script in its workers under spawn/forkserver
+if __name__ == '__main__':
+    # Run Simulations
+    result = sweep.run_sweep(points, t_max, num_traj, target_times, s0=s0)
 
-ax_mean, ax_slope = plot.plot_mean_msd(s0, s_traj, t_traj, target_times, 50, target_axes=(ax_mean, ax_slope))
+    ax_mean, ax_slope = plot.plot_sweep_msd(result, 50)
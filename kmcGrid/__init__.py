@@ -0,0 +1,22 @@
+"""
+Kinetic Monte Carlo on a Grid
+Importing the package loads nothing but the package itself; submodules such as kmcGrid.plot (matplotlib)
+and kmcGrid.master (scipy) are imported on first attribute access, so simulation-only jobs that use
+kmcGrid.kmc and kmcGrid.lattice never pay the plotting or scipy start-up cost
+Written By: Amro Dodin
+"""
+
+import importlib
+
+_SUBMODULES = ('adaptive', 'animate', 'cache', 'checkpoint', 'instrument', 'kmc', 'lattice', 'manybody', 'master',
+               'observables', 'parallel', 'plot', 'sample', 'statistics', 'superbasin', 'sweep', 'trajectory')
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module('kmcGrid.' + name)
+    raise AttributeError("module 'kmcGrid' has no attribute " + repr(name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_SUBMODULES))
@@ -0,0 +1,53 @@
+"""
+Convergence-Driven Ensembles that run trajectories until the mean MSD is known to a requested precision
+Trajectories are run in batches on parallel.run_parallel and folded into statistics.RunningMoments, so the
+ensemble size adapts to each parameter point instead of being fixed up front
+Written By: Amro Dodin
+"""
+
+import os
+from contextlib import nullcontext
+
+import numpy as np
+
+from kmcGrid.observables import calculate_msd
+from kmcGrid.parallel import run_parallel, worker_pool
+from kmcGrid.statistics import RunningMoments
+
+
+def converged(moments, atol, rtol):
+    """ True if the standard error of the mean at every target time is within atol + rtol * |mean| """
+    return moments.count > 1 and bool(np.all(moments.sem <= atol + rtol * np.abs(moments.mean)))
+
+
+def run_converged_msd(s0, lattice, tau, target_times, atol=0., rtol=0.01, batch_size=1000, max_traj=100000,
+                      seed=None, n_workers=None, shuffle=True):
+    """
+    Runs trajectories from s0 up to time tau in batches until the MSD at every target time has a standard error
+    within atol + rtol * MSD, or max_traj trajectories have been run
+    After the first batch each batch is sized from the current standard error, assuming it falls as 1/sqrt(n),
+    but never smaller than batch_size. Batch k uses the k-th stream spawned from seed
+    All batches run on one process pool, started once, so many small batches do not pay for pool start-up
+    Returns the statistics.RunningMoments of the MSD, whose count is the number of trajectories actually used,
+    and whether the tolerance was met
+    """
+    target_times = np.asarray(target_times, dtype=float)
+    moments = RunningMoments(len(target_times))
+    root = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    n_batch = min(batch_size, max_traj)
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    with (nullcontext() if n_workers == 1 else worker_pool(lattice, n_workers)) as pool:
+        while n_batch > 0:
+            timed_states = run_parallel(s0, lattice, tau, n_batch, seed=root.spawn(1)[0], n_workers=n_workers,
+                                        shuffle=shuffle, target_times=target_times, pool=pool)
+            moments.add(calculate_msd(s0, timed_states).T)
+            if converged(moments, atol, rtol):
+                return moments, True
+            # Trajectories needed for the worst target time if its standard error keeps falling as 1/sqrt(n)
+            tol = atol + rtol * np.abs(moments.mean)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ratio = np.nanmax(np.where(moments.sem > tol, moments.sem / tol, 1.))
+            needed = int(np.ceil(moments.count * min(ratio**2, 1e9)))
+            n_batch = min(max(needed - moments.count, batch_size), max_traj - moments.count)
+    return moments, False
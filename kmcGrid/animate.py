@@ -1,12 +1,22 @@
 """
 Animation Functions for Visualizing Time-Dependent KMC Simulations
+Trajectories may be passed as lists or as a PackedTrajectories store (e.g. from trajectory.open_store)
+with time_trajectories set to None
+The render_* functions draw headless, streaming frames one at a time straight to a movie or PNG files
 Written By: Amro Dodin
 """
 
+import queue
+import threading
+from contextlib import contextmanager
+from itertools import count
+
 import numpy as np
-import matplotlib as mpl; mpl.use('TkAgg')
+import matplotlib as mpl
 import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
+from matplotlib.animation import FuncAnimation, FFMpegWriter, PillowWriter
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 
 from kmcGrid import sample as smp
 from kmcGrid.observables import calculate_rmsd, calculate_msd
@@ -52,10 +62,10 @@ def animate_observable_histograms(state_trajectories, time_trajectories, target_
                                   observable_function, observable_kwargs,
                                   observable_name='Observable', observable_units='',
                                   n_bins=100, bin_max=None, ylim=None,
-                                  figkwargs=fig_spec, axis_rect=axis_rect, target_axes=None):
+                                  figkwargs=fig_spec, axis_rect=axis_rect, target_axes=None, cache=None):
     # Calculate Timed MSD distribution
     timed_samples = smp.sample_observable(state_trajectories, time_trajectories, target_times,
-                                          observable_function, observable_kwargs)
+                                          observable_function, observable_kwargs, cache)
 
     # Find Max Width From largest MSD
     if bin_max is None:
@@ -126,14 +136,120 @@ def animate_observable_histograms(state_trajectories, time_trajectories, target_
 
 
 def animate_rmsd_histogram(s0, state_trajectories, time_trajectories, target_times, nbins=20, observable_units='nm',
-                           bin_max=None, ylim=None, target_axes=None, figkwargs=fig_spec, axis_rect=axis_rect):
+                           bin_max=None, ylim=None, target_axes=None, figkwargs=fig_spec, axis_rect=axis_rect,
+                           cache=None):
     return animate_observable_histograms(state_trajectories, time_trajectories, target_times,
                                          calculate_rmsd, {'s0': s0}, 'RMSD', observable_units, nbins,
-                                         bin_max, ylim, figkwargs, axis_rect, target_axes)
+                                         bin_max, ylim, figkwargs, axis_rect, target_axes, cache)
 
 
 def animate_msd_histogram(s0, state_trajectories, time_trajectories, target_times, nbins=20, observable_units=r'nm$^2$',
-                          bin_max=None, ylim=None, target_axes=None, figkwargs=fig_spec, axis_rect=axis_rect):
+                          bin_max=None, ylim=None, target_axes=None, figkwargs=fig_spec, axis_rect=axis_rect,
+                          cache=None):
     return animate_observable_histograms(state_trajectories, time_trajectories, target_times,
                                          calculate_msd, {'s0': s0}, 'MSD', observable_units, nbins, bin_max, ylim,
-                                         figkwargs, axis_rect, target_axes)
+                                         figkwargs, axis_rect, target_axes, cache)
+
+
+def _prefetch(frames, depth=2):
+    """ Iterates over frames while a background thread computes up to depth frames ahead """
+    buffer = queue.Queue(maxsize=depth)
+    done = object()
+
+    def produce():
+        try:
+            for frame in frames:
+                buffer.put(frame)
+        except Exception as error:
+            buffer.put(error)
+        buffer.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        frame = buffer.get()
+        if frame is done:
+            return
+        if isinstance(frame, Exception):
+            raise frame
+        yield frame
+
+
+@contextmanager
+def _frame_sink(fig, path, fps, dpi):
+    """
+    Yields a function that writes the current state of fig as the next frame of path
+    A path containing a format field such as 'frames/pop_{:04d}.png' writes one image per frame,
+    a .gif path is written with Pillow and any other path (e.g. .mp4) is streamed to ffmpeg
+    """
+    if '{' in path:
+        frame_number = count()
+        yield lambda: fig.savefig(path.format(next(frame_number)), dpi=dpi)
+        return
+    writer = PillowWriter(fps=fps) if path.endswith('.gif') else FFMpegWriter(fps=fps)
+    with writer.saving(fig, path, dpi):
+        yield writer.grab_frame
+
+
+def _headless_figure(figkwargs):
+    fig = Figure(**figkwargs)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def render_populations(frames, lattice, path, num_traj=1, fps=10, dpi=100, figkwargs=fig_spec, axis_rect=axis_rect,
+                       axis_units='nm', axis_scale=1., imkwargs={}, prefetch=True):
+    """
+    Renders population frames on a 2D lattice to path without a display, one frame at a time
+    frames is any iterable of site counts of shape lattice.size, e.g. sample.iter_trajectory_counts,
+    and counts are divided by num_traj. With prefetch the next frames are sampled while the current one is drawn
+    """
+    assert lattice.dim == 2
+    norm = mpl.colors.LogNorm(vmin=1/num_traj, vmax=1.0)
+    sx, sy = lattice.size
+    if type(axis_scale) is not tuple:
+        axis_scale = (axis_scale, axis_scale)
+    sx = sx * axis_scale[0]
+    sy = sy * axis_scale[1]
+
+    fig = _headless_figure(figkwargs)
+    ax = fig.add_axes(axis_rect)
+    ax.set_xlabel('x (' + axis_units + ')')
+    ax.set_ylabel('y (' + axis_units + ')')
+    im = ax.imshow(np.zeros(lattice.size), origin='lower', extent=[0, sx, 0, sy], norm=norm, **imkwargs)
+
+    if prefetch:
+        frames = _prefetch(frames)
+    with _frame_sink(fig, path, fps, dpi) as write_frame:
+        for counts in frames:
+            im.set_array(counts/num_traj)
+            write_frame()
+    return path
+
+
+def render_observable_histograms(frames, bins, path, observable_name='Observable', observable_units='', ylim=None,
+                                 fps=10, dpi=100, figkwargs=fig_spec, axis_rect=axis_rect, prefetch=True):
+    """
+    Renders density histograms of observable samples to path without a display, one frame at a time
+    frames is any iterable of per-trajectory samples at successive target times, e.g. sample.iter_observable_samples
+    ylim defaults to 1.5 times the peak of the first frame, since later frames are not known in advance
+    """
+    bins = np.asarray(bins)
+    fig = _headless_figure(figkwargs)
+    ax = fig.add_axes(axis_rect)
+    ax.set_xlim(bins[0], bins[-1])
+    ax.set_xlabel(observable_name + ' (' + observable_units + ')')
+    ax.set_ylabel('P(' + observable_name + ')')
+    ax.set_yticks([])
+    stairs = ax.stairs(np.zeros(len(bins) - 1), bins, fill=True, facecolor='pink', edgecolor='red')
+
+    if prefetch:
+        frames = _prefetch(frames)
+    with _frame_sink(fig, path, fps, dpi) as write_frame:
+        for samples in frames:
+            n, _ = np.histogram(samples, bins, density=True)
+            stairs.set_data(n)
+            if ylim is None:
+                ylim = (0., 1.5 * max(np.max(n), 1e-12))
+            ax.set_ylim(*ylim)
+            write_frame()
+    return path
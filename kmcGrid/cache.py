@@ -0,0 +1,96 @@
+"""
+Memoization of Sampled Observables shared between plots and animations
+Entries are keyed on the trajectory data, target times, observable function object and its kwargs
+Caching is opt-in: pass a SampleCache to the sampling, plotting and animation functions together with a
+PackedTrajectories store packed once (trajectory.pack), which remembers its fingerprint. Trajectory lists would be
+repacked and rehashed on every call, costing about as much as sampling them again
+Written By: Amro Dodin
+"""
+
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+def fingerprint(packed):
+    """
+    Content hash of a PackedTrajectories store, computed once and remembered on the store
+    Stores holding coordinates hash the coordinates themselves, since flat sites over an inferred or wrapped
+    lattice size can map different paths to the same indices. Stores of sites hash them with size and periodic
+    """
+    if packed._fingerprint is None:
+        h = hashlib.blake2b(digest_size=16)
+        if packed._states is not None:
+            states = np.asarray(packed._states)
+            h.update(repr((states.dtype.str, states.shape)).encode())
+            arrays = (packed.offsets, packed.times, states)
+        else:
+            h.update(repr((packed.size, packed.periodic, np.asarray(packed._sites).dtype.str)).encode())
+            arrays = (packed.offsets, packed.times, packed._sites)
+        for array in arrays:
+            h.update(np.ascontiguousarray(array).view(np.uint8))
+        packed._fingerprint = h.hexdigest()
+    return packed._fingerprint
+
+
+def _freeze(value):
+    """ Hashable stand-in for an observable kwarg value """
+    if isinstance(value, np.ndarray):
+        return value.dtype.str, value.shape, hashlib.blake2b(np.ascontiguousarray(value).tobytes()).hexdigest()
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class SampleCache:
+    """ Least recently used cache of sampled observable grids holding at most max_bytes of arrays """
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def key(self, packed, target_times, calculate_observable, observable_kwargs):
+        """
+        Cache key for sampling calculate_observable(**observable_kwargs) on packed at target_times
+        The function object itself is part of the key, so distinct lambdas or closures never share entries;
+        the key holds a reference to it, so its identity cannot be reused while the entry lives
+        """
+        return (fingerprint(packed), _freeze(np.asarray(target_times, dtype=float)), calculate_observable,
+                _freeze(observable_kwargs))
+
+    def get(self, key):
+        """ Cached array for key or None. A hit marks the entry as most recently used """
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """ Stores a read-only copy of value, evicting least recently used entries to stay within max_bytes """
+        value = np.array(value)
+        if value.nbytes > self.max_bytes:
+            return value
+        value.flags.writeable = False
+        if key in self._entries:
+            self.n_bytes -= self._entries.pop(key).nbytes
+        self._entries[key] = value
+        self.n_bytes += value.nbytes
+        while self.n_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.n_bytes -= evicted.nbytes
+        return value
+
+    def clear(self):
+        self._entries.clear()
+        self.n_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
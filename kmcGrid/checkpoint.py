@@ -0,0 +1,127 @@
+"""
+Checkpoint Snapshots so that long ensemble runs can be stopped and resumed exactly
+A snapshot is a compressed .npz file of named arrays, written to a temporary file and renamed into place so an
+interrupted write never leaves a corrupt snapshot behind. Random generator states are stored alongside the arrays
+as plain arrays and JSON text, never pickled, so loading a snapshot cannot run code
+Logs that only grow, such as the hops of a run, go to an append-only SegmentLog instead, so each checkpoint writes
+only what is new; a snapshot records how much of the log it covers
+Written By: Amro Dodin
+"""
+
+import json
+import os
+
+import numpy as np
+
+# Snapshot entries of a Generator's bit_generator.state (as JSON) and of the fields of the legacy global state
+_RNG = 'rng_state'
+_LEGACY_RNG = ('rng_key', 'rng_pos', 'rng_has_gauss', 'rng_cached_gaussian')
+
+
+def rng_state(rng):
+    """ Current state of a numpy Generator, or of the global state if rng is the np.random module """
+    if rng is np.random:
+        return np.random.get_state()
+    return rng.bit_generator.state
+
+
+def set_rng_state(rng, state):
+    """ Restores a state returned by rng_state """
+    if rng is np.random:
+        np.random.set_state(state)
+    else:
+        rng.bit_generator.state = state
+
+
+def _rng_arrays(rng):
+    """ Snapshot entries holding the state of rng """
+    state = rng_state(rng)
+    if rng is np.random:
+        return dict(zip(_LEGACY_RNG, state[1:]))
+    # Bit generator states are dicts of python ints, plus key arrays for some generators such as MT19937
+    return {_RNG: np.array(json.dumps(state, default=lambda value: value.tolist()))}
+
+
+def _pop_rng_state(arrays):
+    """ Removes the random state entries from the arrays of a snapshot and returns the state, or None """
+    if _RNG in arrays:
+        return json.loads(str(arrays.pop(_RNG)))
+    if _LEGACY_RNG[0] in arrays:
+        key, pos, has_gauss, cached_gaussian = (arrays.pop(name) for name in _LEGACY_RNG)
+        return 'MT19937', key, int(pos), int(has_gauss), float(cached_gaussian)
+    return None
+
+
+def save_snapshot(path, rng=None, **arrays):
+    """ Atomically writes arrays (and the state of rng if given) to the snapshot file path """
+    if rng is not None:
+        arrays.update(_rng_arrays(rng))
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp, path)
+
+
+def load_snapshot(path, rng=None):
+    """ Reads the arrays of a snapshot as a dict, restoring the saved random state into rng if given """
+    with np.load(path) as snapshot:
+        arrays = {name: snapshot[name] for name in snapshot.files}
+    state = _pop_rng_state(arrays)
+    if rng is not None and state is not None:
+        set_rng_state(rng, state)
+    return arrays
+
+
+def landscape(lattice):
+    """ The arrays that define the current landscape of lattice, to be saved in a snapshot """
+    if hasattr(lattice, 'energy'):
+        return {'energy': lattice.energy}
+    # Seeds may be 128-bit python ints, so they are kept as strings rather than object arrays
+    return {'landscape_seed': np.array(str(lattice.seed))}
+
+
+def restore_landscape(lattice, arrays):
+    """ Puts back a landscape saved with landscape, rebuilding the rate tables if needed """
+    if 'energy' in arrays:
+        lattice.energy = arrays['energy']
+        lattice.build_rate_tables()
+    elif 'landscape_seed' in arrays:
+        lattice.seed = int(str(arrays['landscape_seed']))
+        lattice._tiles.clear()
+
+
+class SegmentLog:
+    """
+    Append-only raw files in directory, one per column of columns (a dict of name to dtype), all of equal length
+    Appended data only counts once a snapshot records the new length; truncate drops anything written after it
+    """
+    def __init__(self, directory, columns):
+        self.columns = {name: np.dtype(dtype) for name, dtype in columns.items()}
+        self._paths = {name: os.path.join(directory, name + '.bin') for name in columns}
+        for path in self._paths.values():
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+        self.length = 0
+
+    def append(self, **arrays):
+        """ Appends equally long arrays to every column and flushes them to disk """
+        lengths = {len(a) for a in arrays.values()}
+        assert set(arrays) == set(self.columns) and len(lengths) == 1
+        for name, array in arrays.items():
+            with open(self._paths[name], 'ab') as f:
+                np.asarray(array, dtype=self.columns[name]).tofile(f)
+                f.flush()
+                os.fsync(f.fileno())
+        self.length += lengths.pop()
+
+    def truncate(self, length):
+        """ Cuts every column back to length entries, e.g. the length recorded by the last snapshot """
+        for name, path in self._paths.items():
+            with open(path, 'r+b') as f:
+                f.truncate(length * self.columns[name].itemsize)
+        self.length = length
+
+    def read(self):
+        """ Every column as an array """
+        return {name: np.fromfile(path, dtype=self.columns[name], count=self.length)
+                for name, path in self._paths.items()}
@@ -0,0 +1,62 @@
+"""
+Opt-in Instrumentation and Progress Reporting for KMC runs
+Pass a RunStats (and optionally a callback) to kmc.run to collect hop counts and per-phase wall times
+Written By: Amro Dodin
+"""
+
+# Phases timed inside the instrumented hop loop
+PHASES = ('lookup', 'random', 'select', 'record')
+
+
+class RunStats:
+    """
+    Counters collected across one or more kmc.run calls
+    boundary_hops counts hops made from sites with fewer than the full set of neighbors (walls limit the move set)
+    The engine is rejection free, so there are no rejected moves to count
+    With time_phases False only counters and total wall time are kept and kmc.run uses its uninstrumented loop
+    """
+    def __init__(self, time_phases=True):
+        self.time_phases = time_phases
+        self.trajectories = 0
+        self.hops = 0
+        self.boundary_hops = 0
+        self.wall_seconds = 0.
+        self.phase_seconds = dict.fromkeys(PHASES, 0.)
+
+    @property
+    def hops_per_second(self):
+        return self.hops / self.wall_seconds if self.wall_seconds > 0 else 0.
+
+    def merge(self, other):
+        """ Adds the counters of another RunStats, e.g. from another worker """
+        self.trajectories += other.trajectories
+        self.hops += other.hops
+        self.boundary_hops += other.boundary_hops
+        self.wall_seconds += other.wall_seconds
+        for phase in PHASES:
+            self.phase_seconds[phase] += other.phase_seconds[phase]
+
+    def summary(self):
+        phases = ', '.join(phase + ' ' + '%.3g' % seconds + ' s' for phase, seconds in self.phase_seconds.items())
+        return ('%d trajectories, %d hops (%d boundary limited) in %.3g s, %.3g hops/s [%s]'
+                % (self.trajectories, self.hops, self.boundary_hops, self.wall_seconds, self.hops_per_second, phases))
+
+
+class ProgressReporter:
+    """
+    Callback for kmc.run that prints progress every `every` finished trajectories out of num_traj
+    Replaces printing a line per trajectory in simulation loops
+    """
+    def __init__(self, num_traj, every=None, stream=None):
+        self.num_traj = num_traj
+        self.every = every if every is not None else max(1, int(num_traj / 100))
+        self.stream = stream
+        self._last = 0
+
+    def __call__(self, stats):
+        done = stats.trajectories
+        if done == self._last or (done % self.every != 0 and done != self.num_traj):
+            return
+        self._last = done
+        print(str(done) + '/' + str(self.num_traj) + ' trajectories, %.3g hops/s' % stats.hops_per_second,
+              file=self.stream)
@@ -2,42 +2,502 @@
 Written by: Amro Dodin
 """
 
+import os
+from time import perf_counter as clock
+
 import numpy as np
 
+from kmcGrid.checkpoint import SegmentLog, landscape, load_snapshot, restore_landscape, save_snapshot
+from kmcGrid.instrument import RunStats
+from kmcGrid.trajectory import PackedTrajectories, Trajectory
+
+
+def step(s0, lattice, rng=np.random):
+    """
+    Single rejection free hop from flat site index s0 using the precomputed lattice rate tables
+    rng is any object with a random() method, e.g. a numpy.random.Generator. Defaults to the global numpy state
+    """
+    column, dt = _step_column(s0, lattice, rng)
+    return lattice.neighbor_table[s0, column], dt
+
+
+def _step_column(s0, lattice, rng):
+    """ step returning the neighbor table column of the hop instead of the new site """
+    k_cum = lattice.cum_rates[s0]
+    k_tot = k_cum[-1]
+    u = rng.random()
+    column = np.searchsorted(k_cum, k_tot * u, side='right')
+    u_time = rng.random()
+    dt = -np.log(u_time)/k_tot
+    return column, dt
+
+
+def run(s0, lattice, tau, rng=np.random, target_times=None, stats=None, callback=None, report_every=100000,
+        accelerate=None, occupancy=None, compact=False, time_dtype=np.float64):
+    """
+    Runs a single trajectory from state tuple s0 up to time tau. Hops are made on flat site indices, or on
+    state tuples for lattices without index tables such as TiledSCLattice, which support only target_times
+    If target_times (sorted) is given only the state held at each target time is kept and an array of shape
+    (n_targets, dim) is returned instead of the full trajectory, using the same convention as sample.py
+    Passing an instrument.RunStats as stats (or a callback) records hop counts and wall times. callback(stats) is
+    called when the run ends and, if stats times phases, every report_every hops of the instrumented loop.
+    A callback given without stats gets a counting-only RunStats, so progress reporting does not time phases
+    Passing a superbasin.TrapAccelerator as accelerate jumps walkers out of small trapping basins in one step with
+    the exact exit time and exit site statistics. Hops inside a basin are never made, so accelerate requires
+    target_times: targets falling inside a stay are filled from the exact bridge distribution of the basin
+    (TrapAccelerator.bridge) rather than from the site where the trap was detected
+    Passing a statistics.OccupancyAccumulator as occupancy adds this trajectory's site occupancy at the
+    accumulator's target times and its dwell time on every site straight into it; nothing else is kept
+    and the accumulator is returned
+    With compact the states are returned as a trajectory.Trajectory of typed flat site indices, which behaves as the
+    list of state tuples but takes about ten bytes per hop; the times array is a view of the same trajectory.
+    time_dtype=np.float32 stores those times in half the memory, at about 7 significant digits of the time since
+    the run started. compact cannot be combined with the other modes or with lattices without index tables
+    """
+    assert compact or time_dtype == np.float64
+    assert not compact or (lattice.indexed and target_times is None and stats is None and callback is None
+                           and accelerate is None and occupancy is None)
+    if occupancy is not None:
+        assert lattice.indexed and target_times is None and stats is None and callback is None and accelerate is None
+        return _run_occupancy(s0, lattice, tau, rng, occupancy)
+    if not lattice.indexed:
+        assert stats is None and callback is None and accelerate is None
+        return _run_states(s0, lattice, tau, rng, target_times)
+    if accelerate is not None:
+        # A full trajectory would hold the entry site for the whole of each stay and bias any sampling of it
+        assert target_times is not None and stats is None and callback is None
+        return _run_accelerated(s0, lattice, tau, rng, accelerate, target_times)
+    if stats is not None or callback is not None:
+        assert target_times is None
+        if stats is None:
+            stats = RunStats(time_phases=False)
+        return _run_instrumented(s0, lattice, tau, rng, stats, callback, report_every)
+    if target_times is not None:
+        return _run_sampled(s0, lattice, tau, rng, target_times)
+    if compact:
+        return _run_compact(s0, lattice, tau, rng, time_dtype)
+    sites, times = _run_sites(s0, lattice, tau, rng)
+    return lattice.path_to_states(sites), times
+
+
+def _run_sites(s0, lattice, tau, rng):
+    """ Plain loop of run returning the list of visited flat sites and the array of hop times """
+    sites = []
+    times = []
+    curr = lattice.state_to_index(s0)
+    t = 0.
+    sites.append(curr)
+    times.append(t)
+    while t < tau:
+        curr, dt = step(curr, lattice, rng)
+        t += dt
+        if t > tau:
+            t = tau
+        sites.append(curr)
+        times.append(t)
+    return sites, np.array(times)
 
-def step(s0, lattice):
+
+def _run_compact(s0, lattice, tau, rng, time_dtype):
+    """ Plain loop of run recording hops into a compact Trajectory with times of type time_dtype """
+    trajectory = Trajectory(lattice.size, lattice.periodic, time_dtype=time_dtype)
+    curr = lattice.state_to_index(s0)
+    t = 0.
+    trajectory.append(curr, t)
+    while t < tau:
+        curr, dt = step(curr, lattice, rng)
+        t += dt
+        if t > tau:
+            t = tau
+        trajectory.append(curr, t)
+    trajectory.trim()
+    return trajectory, trajectory.times
+
+
+def step_state(s0, lattice, rng=np.random):
+    """ Single rejection free hop from state tuple s0 using lattice.get_neighbors and lattice.get_rates """
     neighbors = lattice.get_neighbors(s0)
-    ks = lattice.get_rates(s0)
-    k_tot = np.sum(ks)
-    k_cum = np.cumsum(ks)
-    assert len(k_cum) == len(neighbors)
-    assert k_cum[-1] == k_tot
-    u = np.random.random()
-    s_next = neighbors[np.argmax( k_tot * u <= k_cum)]
-    u_time = np.random.random()
+    k_cum = np.cumsum(lattice.get_rates(s0))
+    k_tot = k_cum[-1]
+    u = rng.random()
+    s_next = neighbors[np.searchsorted(k_cum, k_tot * u, side='right')]
+    u_time = rng.random()
     dt = -np.log(u_time)/k_tot
     return s_next, dt
 
 
-def run(s0, lattice, tau):
-    states = []
-    times = []
+def _run_states(s0, lattice, tau, rng, target_times):
+    """ Loop of run for lattices without site index tables (e.g. TiledSCLattice), hopping on state tuples """
+    states = [s0]
+    times = [0.]
     curr = s0
     t = 0.
-    states.append(curr)
+    j = 0
+    n_targets = 0 if target_times is None else len(target_times)
+    sampled = []
+    while t < tau and (target_times is None or j < n_targets):
+        nxt, dt = step_state(curr, lattice, rng)
+        t += dt
+        if t > tau:
+            t = tau
+        if target_times is None:
+            states.append(nxt)
+            times.append(t)
+        # Targets up to and including the hop time still see the state before the hop
+        while j < n_targets and target_times[j] <= t:
+            sampled.append(curr)
+            j += 1
+        curr = nxt
+    if target_times is None:
+        return states, np.array(times)
+    sampled.extend([curr] * (n_targets - j))
+    return np.array(sampled).reshape(n_targets, lattice.dim)
+
+
+def _run_accelerated(s0, lattice, tau, rng, accelerator, target_times):
+    """ Accelerated loop keeping only the states at target_times, filling targets inside stays by bridge sampling """
+    target_times = np.asarray(target_times, dtype=float)
+    n_targets = len(target_times)
+    sampled = np.empty(n_targets, dtype=np.intp)
+    # On periodic lattices shift tracks how far the unwrapped path has moved past the grid edges
+    shift = np.zeros(lattice.dim, dtype=np.intp)
+    sampled_shifts = np.zeros((n_targets, lattice.dim), dtype=np.intp)
+    wrap = lattice.wrap_table
+    curr = lattice.state_to_index(s0)
+    t = 0.
+    j = 0
+    accelerator.reset()
+    while t < tau and j < n_targets:
+        basin = accelerator.observe(curr)
+        if basin is None:
+            column, dt = _step_column(curr, lattice, rng)
+            nxt = lattice.neighbor_table[curr, column]
+            t_new = min(t + dt, tau)
+            # Targets up to and including the hop time still see the state before the hop
+            k = np.searchsorted(target_times, t_new, side='right')
+            sampled[j:k] = curr
+            sampled_shifts[j:k] = shift
+            if wrap is not None:
+                shift += wrap[curr, column]
+        else:
+            dt, nxt, exited = accelerator.escape(basin, curr, tau - t, rng)
+            t_new = min(t + dt, tau)
+            k = np.searchsorted(target_times, t_new, side='right')
+            inside = accelerator.bridge(basin, curr, accelerator.last_site, dt, target_times[j:k] - t, rng)
+            sampled[j:k] = inside
+            sampled_shifts[j:k] = shift
+            if lattice.periodic and k > j:
+                # Basin sites may straddle the grid edge, so place them relative to the entry site
+                moved = lattice.displacement(np.full(k - j, curr), sampled[j:k])
+                raw = lattice.index_to_coords(sampled[j:k]) - lattice.index_to_coords(curr)
+                sampled_shifts[j:k] += moved - raw
+            if lattice.periodic:
+                # Escapes leave from anywhere in the basin, so the shift comes from the minimum image jump
+                shift += lattice.displacement(curr, nxt) - (lattice.index_to_coords(nxt)
+                                                            - lattice.index_to_coords(curr))
+        j = max(j, k)
+        t = t_new
+        curr = nxt
+    sampled[j:] = curr
+    sampled_shifts[j:] = shift
+    return lattice.index_to_coords(sampled) + sampled_shifts
+
+
+def _run_instrumented(s0, lattice, tau, rng, stats, callback, report_every):
+    """ Times each phase of an inlined hop loop into stats, or only counts hops if stats does not time phases """
+    start = clock()
+    if not stats.time_phases:
+        sites, times = _run_sites(s0, lattice, tau, rng)
+        # Every hop but the last starts from one of these sites
+        neighbors = lattice.neighbor_table[np.array(sites[:-1], dtype=np.intp)]
+        stats.boundary_hops += int(np.sum(np.any(neighbors < 0, axis=1)))
+        stats.hops += len(sites) - 1
+        stats.trajectories += 1
+        stats.wall_seconds += clock() - start
+        if callback is not None:
+            callback(stats)
+        return lattice.path_to_states(sites), times
+
+    phases = stats.phase_seconds
+    sites = []
+    times = []
+    curr = lattice.state_to_index(s0)
+    t = 0.
+    sites.append(curr)
     times.append(t)
+    hops = 0
     while t < tau:
-        curr, dt = step(curr, lattice)
-        t += dt
+        t0 = clock()
+        k_cum = lattice.cum_rates[curr]
+        boundary = np.any(lattice.neighbor_table[curr] < 0)
+        t1 = clock()
+        u = rng.random()
+        u_time = rng.random()
+        t2 = clock()
+        k_tot = k_cum[-1]
+        curr = lattice.neighbor_table[curr, np.searchsorted(k_cum, k_tot * u, side='right')]
+        t += -np.log(u_time)/k_tot
         if t > tau:
             t = tau
-        states.append(curr)
+        t3 = clock()
+        sites.append(curr)
         times.append(t)
-    return states, np.array(times)
+        t4 = clock()
+
+        phases['lookup'] += t1 - t0
+        phases['random'] += t2 - t1
+        phases['select'] += t3 - t2
+        phases['record'] += t4 - t3
+        stats.boundary_hops += int(boundary)
+        hops += 1
+        if callback is not None and hops % report_every == 0:
+            stats.hops += hops
+            stats.wall_seconds += clock() - start
+            hops = 0
+            start = clock()
+            callback(stats)
+    stats.hops += hops
+    stats.trajectories += 1
+    stats.wall_seconds += clock() - start
+    if callback is not None:
+        callback(stats)
+    return lattice.path_to_states(sites), np.array(times)
+
+
+def _run_sampled(s0, lattice, tau, rng, target_times):
+    """ Runs a single trajectory keeping only the states at target_times """
+    target_times = np.asarray(target_times, dtype=float)
+    n_targets = len(target_times)
+    sampled = np.empty(n_targets, dtype=np.intp)
+    # On periodic lattices shift tracks how far the unwrapped path has moved past the grid edges
+    shift = np.zeros(lattice.dim, dtype=np.intp)
+    sampled_shifts = np.zeros((n_targets, lattice.dim), dtype=np.intp)
+    wrap = lattice.wrap_table
+    curr = lattice.state_to_index(s0)
+    t = 0.
+    j = 0
+    while t < tau and j < n_targets:
+        column, dt = _step_column(curr, lattice, rng)
+        nxt = lattice.neighbor_table[curr, column]
+        t += dt
+        if t > tau:
+            t = tau
+        # Targets up to and including the hop time still see the state before the hop
+        while j < n_targets and target_times[j] <= t:
+            sampled[j] = curr
+            sampled_shifts[j] = shift
+            j += 1
+        if wrap is not None:
+            shift += wrap[curr, column]
+        curr = nxt
+    sampled[j:] = curr
+    sampled_shifts[j:] = shift
+    return lattice.index_to_coords(sampled) + sampled_shifts
+
+
+def _run_occupancy(s0, lattice, tau, rng, occupancy):
+    """ Runs a single trajectory adding its occupancy at target times and its dwell times to occupancy """
+    target_times = occupancy.target_times
+    n_targets = len(target_times)
+    counts = occupancy.flat_counts
+    dwell = occupancy.flat_dwell
+    curr = lattice.state_to_index(s0)
+    t = 0.
+    j = 0
+    while t < tau:
+        nxt, dt = step(curr, lattice, rng)
+        t_new = min(t + dt, tau)
+        dwell[curr] += t_new - t
+        # Targets up to and including the hop time still see the state before the hop
+        while j < n_targets and target_times[j] <= t_new:
+            counts[j, curr] += 1
+            j += 1
+        t = t_new
+        curr = nxt
+    counts[np.arange(j, n_targets), curr] += 1
+    occupancy.count += 1
+    occupancy.total_time += tau
+    return occupancy
+
+
+def _lockstep(curr, t, lattice, t_stop, tau, rng):
+    """
+    Advances walkers at flat sites curr with clocks t in lockstep until each clock reaches t_stop (capped at tau)
+    curr and t are updated in place. Yields (active, previous_sites, columns, sites, times) for every iteration,
+    where columns are the neighbor table columns of the hops
+    """
+    active = np.flatnonzero(t < t_stop)
+    while active.size > 0:
+        previous = curr[active]
+        k_cum = lattice.cum_rates[previous]
+        k_tot = k_cum[:, -1]
+        u = rng.random((2, active.size))
+        column = np.sum(k_cum <= (k_tot * u[0])[:, np.newaxis], axis=1)
+        sites = lattice.neighbor_table[previous, column]
+        t_new = np.minimum(t[active] - np.log(u[1])/k_tot, tau)
+        curr[active] = sites
+        t[active] = t_new
+        yield active, previous, column, sites, t_new
+        active = active[t_new < t_stop]
+
+
+def _crossed_targets(target_times, next_target, active, times):
+    """
+    Target times passed by one lockstep iteration, in which walkers active hopped at times. next_target holds the
+    index of each walker's first target not yet passed and is advanced in place. Returns (hops, targets): for every
+    passed target, the position in active of the hop that passed it and the target index. Such a target sees the
+    state before the hop
+    """
+    passed = np.searchsorted(target_times, times, side='right')
+    counts = passed - next_target[active]
+    first = np.cumsum(counts) - counts
+    hops = np.repeat(np.arange(active.size), counts)
+    targets = np.repeat(next_target[active] - first, counts) + np.arange(hops.size)
+    next_target[active] = passed
+    return hops, targets
+
+
+def _unfilled_targets(next_target, n_targets):
+    """ (n_walkers, n_targets) mask of the targets beyond the end of each walker's run, which see its final state """
+    return np.arange(n_targets) >= next_target[:, np.newaxis]
+
+
+# Files of a checkpointed run_ensemble: the walker snapshot and the landscape, next to the hop log
+_ENSEMBLE_STATE = 'state.npz'
+_ENSEMBLE_LANDSCAPE = 'landscape.npz'
+
+
+def run_ensemble(s0, lattice, tau, n_walkers, rng=np.random, target_times=None, packed=False, checkpoint=None,
+                 checkpoint_every=60., occupancy=None):
+    """
+    Runs n_walkers independent trajectories from state tuple s0 up to time tau on a fixed landscape
+    All walker positions and clocks are held in arrays and every active walker hops once per iteration
+    Returns lists of state and time trajectories in the same format as repeated calls to run,
+    or a PackedTrajectories store of flat site indices if packed is True
+    If target_times (sorted) is given, returns only the states at those times as an (n_walkers, n_targets, dim) array
+    If checkpoint is a directory, the lattice energies are saved there once and then, every checkpoint_every
+    seconds and when the run ends, the hops made since the last save are appended to a checkpoint.SegmentLog and
+    the walker sites and clocks and random state are snapshotted. If the directory already holds a snapshot the
+    lattice landscape and rng are restored from it and the run continues exactly where the snapshot was taken
+    If a statistics.OccupancyAccumulator is given as occupancy, the walkers' occupancy and dwell times are added
+    to it as they hop instead of being stored, and the accumulator is returned
+    The lattice needs site index tables, so lattices such as TiledSCLattice must be run walker by walker with run
+    """
+    assert lattice.indexed
+    if occupancy is not None:
+        assert target_times is None and checkpoint is None
+        return _run_ensemble_occupancy(s0, lattice, tau, n_walkers, rng, occupancy)
+    if target_times is not None:
+        assert checkpoint is None
+        return _run_ensemble_sampled(s0, lattice, tau, n_walkers, rng, target_times)
+    curr = np.full(n_walkers, lattice.state_to_index(s0), dtype=np.intp)
+    t = np.zeros(n_walkers)
+    walker_log = [np.arange(n_walkers)]
+    site_log = [curr.copy()]
+    time_log = [np.zeros(n_walkers)]
+    # Number of leading log segments already on disk
+    logged = 0
+    if checkpoint is not None:
+        os.makedirs(checkpoint, exist_ok=True)
+        state_file = os.path.join(checkpoint, _ENSEMBLE_STATE)
+        landscape_file = os.path.join(checkpoint, _ENSEMBLE_LANDSCAPE)
+        log = SegmentLog(checkpoint, {'walkers': '<i8', 'sites': '<i8', 'times': '<f8'})
+        if os.path.exists(state_file):
+            snapshot = load_snapshot(state_file, rng)
+            assert snapshot['tau'] == tau and len(snapshot['curr']) == n_walkers
+            restore_landscape(lattice, load_snapshot(landscape_file))
+            curr, t = snapshot['curr'], snapshot['t']
+            log.truncate(int(snapshot['n_logged']))
+            hops = log.read()
+            walker_log, site_log, time_log = [hops['walkers']], [hops['sites']], [hops['times']]
+            logged = 1
+        else:
+            log.truncate(0)
+            save_snapshot(landscape_file, **landscape(lattice))
+
+    def save():
+        nonlocal logged
+        if logged < len(walker_log):
+            log.append(walkers=np.concatenate(walker_log[logged:]), sites=np.concatenate(site_log[logged:]),
+                       times=np.concatenate(time_log[logged:]))
+            logged = len(walker_log)
+        save_snapshot(state_file, rng, tau=tau, curr=curr, t=t, n_logged=log.length)
+
+    last_save = clock()
+    for active, previous, _, sites, times in _lockstep(curr, t, lattice, tau, tau, rng):
+        walker_log.append(active)
+        site_log.append(sites)
+        time_log.append(times)
+        if checkpoint is not None and clock() - last_save > checkpoint_every:
+            save()
+            last_save = clock()
+    if checkpoint is not None:
+        save()
+
+    # Regroup the hop log by walker, keeping each walker's hops in time order
+    walkers = np.concatenate(walker_log)
+    order = np.argsort(walkers, kind='stable')
+    sites = np.concatenate(site_log)[order]
+    times = np.concatenate(time_log)[order]
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(walkers, minlength=n_walkers))))
+    trajectories = PackedTrajectories(times, offsets, sites=sites, size=lattice.size, periodic=lattice.periodic)
+    if packed:
+        return trajectories
+    return trajectories.to_lists()
+
+
+def _run_ensemble_occupancy(s0, lattice, tau, n_walkers, rng, occupancy):
+    """ Lockstep ensemble adding walker occupancy at target times and dwell times to occupancy """
+    target_times = occupancy.target_times
+    n_targets = len(target_times)
+    counts = occupancy.flat_counts
+    dwell = occupancy.flat_dwell
+    next_target = np.zeros(n_walkers, dtype=np.intp)
+    curr = np.full(n_walkers, lattice.state_to_index(s0), dtype=np.intp)
+    t = np.zeros(n_walkers)
+    t_prev = np.zeros(n_walkers)
+    for active, previous, _, sites, times in _lockstep(curr, t, lattice, tau, tau, rng):
+        dwell += np.bincount(previous, times - t_prev[active], minlength=len(dwell))
+        t_prev[active] = times
+        hops, targets = _crossed_targets(target_times, next_target, active, times)
+        np.add.at(counts, (targets, previous[hops]), 1)
+
+    unfilled = _unfilled_targets(next_target, n_targets)
+    np.add.at(counts, (np.nonzero(unfilled)[1], np.repeat(curr, np.sum(unfilled, axis=1))), 1)
+    occupancy.count += n_walkers
+    occupancy.total_time += n_walkers * tau
+    return occupancy
+
+
+def _run_ensemble_sampled(s0, lattice, tau, n_walkers, rng, target_times):
+    """ Lockstep ensemble keeping only the walker states at target_times """
+    target_times = np.asarray(target_times, dtype=float)
+    n_targets = len(target_times)
+    sampled = np.empty((n_walkers, n_targets), dtype=np.intp)
+    # On periodic lattices shift tracks how far each unwrapped path has moved past the grid edges
+    shift = np.zeros((n_walkers, lattice.dim), dtype=np.intp)
+    sampled_shifts = np.zeros((n_walkers, n_targets, lattice.dim), dtype=np.intp)
+    next_target = np.zeros(n_walkers, dtype=np.intp)
+    curr = np.full(n_walkers, lattice.state_to_index(s0), dtype=np.intp)
+    t = np.zeros(n_walkers)
+    t_stop = min(tau, target_times[-1]) if n_targets > 0 else 0.
+    for active, previous, columns, sites, times in _lockstep(curr, t, lattice, t_stop, tau, rng):
+        hops, targets = _crossed_targets(target_times, next_target, active, times)
+        walkers = active[hops]
+        sampled[walkers, targets] = previous[hops]
+        if lattice.periodic:
+            sampled_shifts[walkers, targets] = shift[walkers]
+            shift[active] += lattice.wrap_table[previous, columns]
+
+    unfilled = _unfilled_targets(next_target, n_targets)
+    sampled = np.where(unfilled, curr[:, np.newaxis], sampled)
+    sampled_shifts = np.where(unfilled[:, :, np.newaxis], shift[:, np.newaxis, :], sampled_shifts)
+    return lattice.index_to_coords(sampled) + sampled_shifts
 
 
 if __name__ == '__main__':
     from kmcGrid import plot
+    from kmcGrid.instrument import ProgressReporter
     from kmcGrid.lattice import SCLattice
 
     T = 300
@@ -49,10 +509,11 @@ if __name__ == '__main__':
     s_traj = []
     t_traj = []
     target_times = np.linspace(0, t_max, n_plot)
+    stats = RunStats(time_phases=False)
+    progress = ProgressReporter(num_traj)
     for i in range(num_traj):
-        print(str(i + 1) + '/' + str(num_traj))
         lattice.shuffle()
-        states, times = run(s0, lattice, t_max)
+        states, times = run(s0, lattice, t_max, stats=stats, callback=progress)
         s_traj.append(states)
         t_traj.append(times)
     plt = plot.plot_mean_msd(s0, s_traj, t_traj, target_times)
@@ -3,63 +3,207 @@ Lattice Classes for KMC Simulations
 Written By: Amro Dodin
 """
 
+from collections import OrderedDict
+
 import numpy as np
 
 k_B = 8.617333E-5
 
 
-class SCLattice:
-    """ Simple Cube Lattice with Nearest Neighbor Coupling """
-    def __init__(self, size, std_energy, rate, temp):
+def nearest_neighbor_offsets(dim):
+    """ Hop offsets to the 2*dim nearest neighbors, ordered -1 then +1 along each axis """
+    offsets = np.zeros((2 * dim, dim), dtype=np.intp)
+    for d in range(dim):
+        offsets[2 * d, d] = -1
+        offsets[2 * d + 1, d] = 1
+    return offsets
+
+
+class StencilLattice:
+    """
+    Hypercubic Lattice with hops to every site displaced by a row of the integer offset table offsets
+    boundary is 'reflect' (hops leaving the grid are dropped) or 'periodic' (hops wrap around the grid)
+    offset_rates optionally scales the prefactor rate of each offset, e.g. to slow down next nearest neighbor hops
+    Neighbor and rate lookups are gathers from tables built by build_tables; only the rate table is rebuilt when
+    the landscape is reshuffled or retargeted to a new temp, rate or std_energy
+    """
+    # Has flat site index neighbor and rate tables for the fast kmc loops
+    indexed = True
+
+    def __init__(self, size, std_energy, rate, temp, offsets=None, boundary='reflect', offset_rates=None):
+        assert boundary in ('reflect', 'periodic')
         self.rate = rate
         self.size = size
         self.dim = len(size)
-        self.energy = np.random.normal(0., std_energy, size)
+        # Energies are std_energy times a standard normal landscape, kept so that retarget can rescale it exactly
+        self._unit_energy = np.random.standard_normal(size)
+        self.energy = std_energy * self._unit_energy
         self.std_energy = std_energy
         self.temp = temp
-        self.__min = tuple(np.zeros(self.dim))
+        if offsets is None:
+            offsets = nearest_neighbor_offsets(self.dim)
+        self.offsets = np.asarray(offsets, dtype=np.intp)
+        assert self.offsets.shape[1] == self.dim
+        self.offset_rates = np.ones(len(self.offsets)) if offset_rates is None else np.asarray(offset_rates)
+        self.boundary = boundary
+        self.periodic = boundary == 'periodic'
+        # Unwrapping periodic paths relies on every hop being shorter than half the box
+        assert not self.periodic or np.all(2 * np.max(np.abs(self.offsets), axis=0) < np.asarray(size))
+        self.build_tables()
 
     def get_neighbors(self, state):
-        mut_state = list(state)
-        neighbors = []
-        size = self.size
-        for d in range(self.dim):
-            mut_state[d] -= 1
-            s_new = tuple(mut_state)
-            condition = all(s >= mn for s, mn in zip(s_new, self.__min))
-            if condition:
-                neighbors.append(s_new)
-            mut_state[d] += 2
-            s_new = tuple(mut_state)
-            condition = all(s < mx for s, mx in zip(s_new, size))
-            if condition:
-                neighbors.append(s_new)
-            mut_state[d] -= 1
-        return neighbors
+        neighbors = self.neighbor_table[self.state_to_index(state)]
+        return self.index_to_states(neighbors[neighbors >= 0])
 
     def get_rates(self, state):
-        neighbors = self.get_neighbors(state)
-        rates = []
-        for n in neighbors:
-            delta = (self.energy[state] - self.energy[n])/(k_B * self.temp)
-            rates.append(self.rate * np.exp(delta))
-        return np.array(rates)
+        index = self.state_to_index(state)
+        rates = np.diff(self.cum_rates[index], prepend=0.)
+        return rates[self.neighbor_table[index] >= 0]
+
+    def build_tables(self):
+        """
+        Precomputes flat neighbor index and cumulative rate tables for the current energy landscape
+        Row i of neighbor_table lists the flat indices of the neighbors of site i in get_neighbors order (-1 if absent)
+        Row i of cum_rates is the cumulative sum of the matching hop rates so cum_rates[i, -1] is the total escape rate
+        On periodic lattices wrap_table[i, c] is the coordinate shift (dim,) that wrapping hop c from site i back into
+        the grid removes, so unwrapped paths add it back with one lookup per hop. It is None on reflecting lattices
+        Must be called again whenever energy, temp or rate are changed by hand (retarget does this for you)
+        """
+        n_sites = int(np.prod(self.size))
+        size = np.asarray(self.size)[:, np.newaxis, np.newaxis]
+        coords = np.indices(self.size).reshape(self.dim, n_sites)
+        shifted = coords[:, :, np.newaxis] + self.offsets.T[:, np.newaxis, :]
+        if self.periodic:
+            self.wrap_table = np.moveaxis(size * (shifted // size), 0, -1)
+            shifted %= size
+            present = np.ones(shifted.shape[1:], dtype=bool)
+        else:
+            self.wrap_table = None
+            present = np.all((shifted >= 0) & (shifted < size), axis=0)
+        neighbors = np.full(present.shape, -1, dtype=np.intp)
+        neighbors[present] = np.ravel_multi_index(shifted[:, present], self.size)
+        self.neighbor_table = neighbors
+        self.build_rate_tables()
 
-    def shuffle(self):
-        self.energy=np.random.normal(0., self.std_energy, self.size)
+    def build_rate_tables(self):
+        """
+        Recomputes the hop energy differences delta_energy and cum_rates from energy, keeping the neighbor table
+        delta_energy[i, c] is energy[i] - energy[neighbor_table[i, c]] in eV (0 where the neighbor is absent)
+        """
+        present = self.neighbor_table >= 0
+        energy = self.energy.ravel()
+        self.delta_energy = np.where(present, energy[:, np.newaxis] - energy[self.neighbor_table], 0.)
+        self._scale_rates()
+
+    def _scale_rates(self):
+        present = self.neighbor_table >= 0
+        rates = self.rate * self.offset_rates * np.exp(self.delta_energy / (k_B * self.temp))
+        self.cum_rates = np.cumsum(np.where(present, rates, 0.), axis=1)
+
+    def retarget(self, temp=None, rate=None, std_energy=None):
+        """
+        Moves the lattice to a new temp, prefactor rate and/or disorder strength std_energy in place
+        The landscape keeps its shape: energies become std_energy times the same standard normal landscape, so they
+        are exactly those a fresh lattice would draw at the new std_energy from the same random stream. Energies set
+        by hand are scaled by the ratio of the new to the old std_energy. Neighbor tables are reused, and for a new
+        temp or rate only the rates are recomputed from the cached delta_energy table
+        """
+        rescale = std_energy is not None and std_energy != self.std_energy
+        if rescale:
+            assert self.std_energy != 0, 'a flat landscape cannot be rescaled to a disordered one'
+            stale = np.shape(self._unit_energy) != np.shape(self.energy)
+            if stale or not np.array_equal(self.energy, self.std_energy * self._unit_energy):
+                # Energies were set by hand (or coarse grained), so their own shape is rescaled
+                self._unit_energy = self.energy / self.std_energy
+            self.energy = std_energy * self._unit_energy
+            self.std_energy = std_energy
+        if temp is not None:
+            self.temp = temp
+        if rate is not None:
+            self.rate = rate
+        if rescale:
+            self.build_rate_tables()
+        else:
+            self._scale_rates()
+
+    def state_to_index(self, state):
+        """ Flat site index of lattice state tuple (wrapped back into the grid on periodic lattices) """
+        return int(np.ravel_multi_index(state, self.size, mode='wrap' if self.periodic else 'raise'))
+
+    def index_to_states(self, indices):
+        """ Converts a sequence of flat site indices to a list of lattice state tuples """
+        coords = np.unravel_index(np.asarray(indices, dtype=np.intp), self.size)
+        return list(zip(*(c.tolist() for c in coords)))
+
+    def index_to_coords(self, indices):
+        """ Converts an array of flat site indices to an array of lattice coordinates with a trailing dim axis """
+        return np.stack(np.unravel_index(indices, self.size), axis=-1)
+
+    def displacement(self, start, end):
+        """ Coordinate displacement of hops from flat sites start to end, using the minimum image if periodic """
+        delta = self.index_to_coords(end) - self.index_to_coords(start)
+        if self.periodic:
+            size = np.asarray(self.size)
+            delta -= size * np.round(delta / size).astype(delta.dtype)
+        return delta
+
+    def path_to_states(self, indices):
+        """
+        Converts the flat site indices visited along one trajectory to a list of state tuples
+        On periodic lattices the path is unwrapped so states keep moving past the grid edges
+        """
+        if not self.periodic:
+            return self.index_to_states(indices)
+        indices = np.asarray(indices, dtype=np.intp)
+        steps = self.displacement(indices[:-1], indices[1:])
+        coords = np.cumsum(np.concatenate((self.index_to_coords(indices[:1]), steps)), axis=0)
+        return list(map(tuple, coords.tolist()))
+
+    def shuffle(self, rng=np.random):
+        self._unit_energy = rng.standard_normal(self.size)
+        self.energy = self.std_energy * self._unit_energy
+        self.build_rate_tables()
+
+    def coarse_grain(self, new_size):
+        """
+        Replaces the landscape by block free energies on a grid of shape new_size (any dimension)
+        Each block holds int(size/new_size) sites per axis and left over sites at the upper edges are dropped
+        The Boltzmann sum over a block is done in log space so large std_energy or low temp cannot overflow
+        """
+        self.energy = self._block_free_energy(self.energy, new_size)
+        self.size = tuple(new_size)
+        self.std_energy = np.std(self.energy)
+        self.build_tables()
 
     def two_dim_coarse_grain(self, new_size):
         assert len(new_size) == 2 == self.dim
-        window = (int(self.size[0]/new_size[0]), int(self.size[1]/new_size[1]))
-        fe = np.zeros(new_size)
-        Z = np.exp(-self.energy/(k_B*self.temp))
-        for i in range(new_size[0]):
-            for j in range(new_size[1]):
-                fe[i,j] = np.sum(Z[i*window[0]:(i+1)*window[0], j*window[1]:(j+1)*window[1]])
-        fe = -k_B * self.temp * np.log(fe)
-        self.energy = fe - np.mean(fe)
-        self.size = new_size
-        self.std_energy = np.std(fe)
+        self.coarse_grain(new_size)
+
+    def coarse_grain_pyramid(self, sizes):
+        """
+        Coarse grained energy landscapes for every grid shape in sizes (finest first), built in one pass
+        Each level is reduced from the previous one, which is exact when the block windows nest
+        Returns a list of energy arrays and leaves this lattice unchanged
+        """
+        levels = []
+        energy = self.energy
+        for new_size in sizes:
+            energy = self._block_free_energy(energy, new_size)
+            levels.append(energy)
+        return levels
+
+    def _block_free_energy(self, energy, new_size):
+        """ Mean-centred block free energies -kT log(sum exp(-E/kT)) of energy over a grid of shape new_size """
+        assert len(new_size) == energy.ndim
+        window = tuple(int(s / n) for s, n in zip(energy.shape, new_size))
+        trimmed = energy[tuple(slice(0, w * n) for w, n in zip(window, new_size))]
+        # Interleave (block, window) axes so each block's window can be reduced by a single reshape
+        blocked = (-trimmed / (k_B * self.temp)).reshape([d for n, w in zip(new_size, window) for d in (n, w)])
+        window_axes = tuple(range(1, 2 * len(new_size), 2))
+        peak = np.max(blocked, axis=window_axes, keepdims=True)
+        log_z = np.log(np.sum(np.exp(blocked - peak), axis=window_axes)) + np.squeeze(peak, axis=window_axes)
+        fe = -k_B * self.temp * log_z
+        return fe - np.mean(fe)
 
     def histogram_energy(self, thermal=True, **kwargs):
         if thermal:
@@ -67,3 +211,79 @@ class SCLattice:
         else:
             Es = self.energy
         return np.histogram(Es, **kwargs)
+
+
+class SCLattice(StencilLattice):
+    """ Simple Cube Lattice with Nearest Neighbor Coupling """
+    def __init__(self, size, std_energy, rate, temp):
+        super().__init__(size, std_energy, rate, temp)
+
+
+class TiledSCLattice:
+    """
+    Simple Cube Lattice with Nearest Neighbor Coupling whose energies are generated lazily in tiles
+    Each tile of shape tile_shape is drawn on first use from a random stream determined by seed and the tile
+    position, so the landscape is reproducible while only touched tiles are held in memory (at most max_tiles)
+    size may be None for an unbounded lattice; otherwise sites outside [0, size) are walls as in SCLattice
+    """
+    # Works on state tuples through get_neighbors and get_rates
+    indexed = False
+
+    def __init__(self, size, std_energy, rate, temp, tile_shape, seed=None, max_tiles=1024):
+        self.rate = rate
+        self.size = size
+        self.dim = len(tile_shape)
+        assert size is None or len(size) == self.dim
+        self.std_energy = std_energy
+        self.temp = temp
+        self.tile_shape = tuple(tile_shape)
+        self.max_tiles = max_tiles
+        self.seed = np.random.SeedSequence(seed).entropy
+        self._tiles = OrderedDict()
+
+    def _tile(self, key):
+        """ Energies of the tile at integer tile position key, generating and caching it if needed """
+        tile = self._tiles.get(key)
+        if tile is not None:
+            self._tiles.move_to_end(key)
+            return tile
+        # Map signed tile positions to distinct non-negative spawn keys
+        spawn_key = tuple(2 * k if k >= 0 else -2 * k - 1 for k in key)
+        rng = np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=spawn_key))
+        tile = rng.normal(0., self.std_energy, self.tile_shape)
+        self._tiles[key] = tile
+        if len(self._tiles) > self.max_tiles:
+            self._tiles.popitem(last=False)
+        return tile
+
+    def energy_at(self, state):
+        key = tuple(s // w for s, w in zip(state, self.tile_shape))
+        local = tuple(s % w for s, w in zip(state, self.tile_shape))
+        return self._tile(key)[local]
+
+    def get_neighbors(self, state):
+        mut_state = list(state)
+        neighbors = []
+        for d in range(self.dim):
+            for shift in (-1, 1):
+                mut_state[d] += shift
+                if self.size is None or 0 <= mut_state[d] < self.size[d]:
+                    neighbors.append(tuple(mut_state))
+                mut_state[d] -= shift
+        return neighbors
+
+    def get_rates(self, state):
+        neighbors = self.get_neighbors(state)
+        energy = self.energy_at(state)
+        delta = np.array([energy - self.energy_at(n) for n in neighbors])/(k_B * self.temp)
+        return self.rate * np.exp(delta)
+
+    def shuffle(self, rng=np.random):
+        """ Switches to a new landscape realization by drawing a new seed from rng """
+        self.seed = int(rng.random() * 2**53)
+        self._tiles.clear()
+
+    @property
+    def n_tiles(self):
+        """ Number of tiles currently held in memory """
+        return len(self._tiles)
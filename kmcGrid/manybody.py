@@ -0,0 +1,153 @@
+"""
+Many Particle KMC with Site Exclusion on indexed lattices
+Every (particle, neighbor) hop is an event whose rate is kept in a Fenwick tree, so selecting an event costs
+O(log N) and a hop only updates the events of the sites it vacates and fills
+Written By: Amro Dodin
+"""
+
+import numpy as np
+
+from kmcGrid.trajectory import PackedTrajectories
+
+
+class FenwickTree:
+    """ Binary indexed tree over non-negative weights with O(log n) updates, prefix sums and weighted selection """
+    def __init__(self, weights):
+        self.weights = [float(w) for w in weights]
+        self.n = len(self.weights)
+        self._top = 1 << max(self.n.bit_length() - 1, 0)
+        self.rebuild()
+
+    def rebuild(self):
+        """ Rebuilds the tree from the stored weights in O(n), clearing accumulated rounding errors """
+        tree = [0.] + self.weights
+        for i in range(1, self.n + 1):
+            parent = i + (i & -i)
+            if parent <= self.n:
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def update(self, i, weight):
+        """ Sets weight i """
+        delta = weight - self.weights[i]
+        if delta == 0.:
+            return
+        self.weights[i] = weight
+        i += 1
+        tree = self.tree
+        while i <= self.n:
+            tree[i] += delta
+            i += i & -i
+
+    def prefix(self, i):
+        """ Sum of the first i weights """
+        tree = self.tree
+        total = 0.
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    @property
+    def total(self):
+        return self.prefix(self.n)
+
+    def find(self, u):
+        """ Index i with prefix(i) <= u < prefix(i + 1), i.e. the event selected by u in [0, total) """
+        tree = self.tree
+        pos = 0
+        step = self._top
+        while step > 0:
+            nxt = pos + step
+            if nxt <= self.n and tree[nxt] <= u:
+                u -= tree[nxt]
+                pos = nxt
+            step >>= 1
+        return min(pos, self.n - 1)
+
+
+def _incoming(lattice):
+    """ For every site, the (source site, column) pairs of the neighbor table that hop into it, in CSR form """
+    sources, columns = np.nonzero(lattice.neighbor_table >= 0)
+    targets = lattice.neighbor_table[sources, columns]
+    order = np.argsort(targets, kind='stable')
+    starts = np.concatenate(([0], np.cumsum(np.bincount(targets, minlength=len(lattice.neighbor_table)))))
+    return sources[order].tolist(), columns[order].tolist(), starts.tolist()
+
+
+def run_exclusion(initial_states, lattice, tau, rng=np.random, rebuild_every=None):
+    """
+    Runs interacting particles starting from the distinct state tuples initial_states up to time tau
+    A hop is only allowed into an empty site. Hop rates otherwise follow the lattice rate tables
+    Returns a PackedTrajectories store with one trajectory per particle, each ending with its state at tau
+    The rate tree is rebuilt every rebuild_every events (default the number of events) to bound rounding drift
+    """
+    n_particles = len(initial_states)
+    n_cols = lattice.neighbor_table.shape[1]
+    neighbor_table = lattice.neighbor_table.tolist()
+    hop_rates = np.diff(lattice.cum_rates, axis=1, prepend=0.).tolist()
+    sources, columns, starts = _incoming(lattice)
+
+    positions = [lattice.state_to_index(s) for s in initial_states]
+    occupant = [-1] * len(neighbor_table)
+    for p, site in enumerate(positions):
+        assert occupant[site] < 0, 'initial states must be distinct'
+        occupant[site] = p
+
+    def event_rate(site, column):
+        target = neighbor_table[site][column]
+        return hop_rates[site][column] if target >= 0 and occupant[target] < 0 else 0.
+
+    tree = FenwickTree([event_rate(site, c) for site in positions for c in range(n_cols)])
+    if rebuild_every is None:
+        rebuild_every = max(tree.n, 1000)
+
+    particle_log = list(range(n_particles))
+    site_log = list(positions)
+    time_log = [0.] * n_particles
+    t = 0.
+    n_events = 0
+    while True:
+        k_tot = tree.total
+        if k_tot <= 0.:
+            break
+        t += -np.log(rng.random())/k_tot
+        if t >= tau:
+            break
+        event = tree.find(rng.random() * k_tot)
+        while tree.weights[event] == 0.:
+            # Rounding can land u on an empty event at the very end of the tree
+            event = tree.find(rng.random() * k_tot)
+        p, column = divmod(event, n_cols)
+        start = positions[p]
+        end = neighbor_table[start][column]
+
+        # Move the particle, then refresh its own events and those of particles next to the two changed sites
+        occupant[start] = -1
+        occupant[end] = p
+        positions[p] = end
+        for c in range(n_cols):
+            tree.update(p * n_cols + c, event_rate(end, c))
+        for site in (start, end):
+            for k in range(starts[site], starts[site + 1]):
+                q = occupant[sources[k]]
+                if q >= 0 and q != p:
+                    tree.update(q * n_cols + columns[k], event_rate(sources[k], columns[k]))
+
+        particle_log.append(p)
+        site_log.append(end)
+        time_log.append(t)
+        n_events += 1
+        if n_events % rebuild_every == 0:
+            tree.rebuild()
+
+    # Close every trajectory with its state at tau
+    particle_log.extend(range(n_particles))
+    site_log.extend(positions)
+    time_log.extend([tau] * n_particles)
+
+    particles = np.array(particle_log)
+    order = np.argsort(particles, kind='stable')
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(particles, minlength=n_particles))))
+    return PackedTrajectories(np.array(time_log)[order], offsets, sites=np.array(site_log)[order],
+                              size=lattice.size, periodic=lattice.periodic)
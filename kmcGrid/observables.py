@@ -4,7 +4,7 @@ Written By: Amro Dodin
 """
 
 import numpy as np
-import scipy.stats as stats
+
 
 def calculate_msd(s0, state_trajectory):
     """ Calculates MSD from initial state s0 along trajectory s_traj """
@@ -20,12 +20,43 @@ def calculate_rmsd(s0, state_trajectory):
 
 
 def window_slope(x, y, window):
-    """ Time-dependent slope of data (x, y) using fixed width window """
+    """
+    Time-dependent slope of data (x, y) using fixed width window
+    Least-squares slopes over x[i:i+window] for i < len(x) - window, from running sums in O(len(x))
+    y may carry trailing axes (e.g. one column per trajectory), giving one slope per column
+    """
     assert len(x) == len(y)
-    length = len(x)
-    slopes = []
-    for i in range(length-window):
-        lim = min(length, i + window)
-        m, c, r, p, s_err = stats.linregress(x[i:lim], y[i:lim])
-        slopes.append(m)
-    return slopes
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n_windows = len(x) - window
+    if n_windows <= 0:
+        return np.zeros((0,) + y.shape[1:])
+    # Centre the data so the running sums of squares do not lose precision to large offsets
+    x = x - np.mean(x)
+    y = y - np.mean(y, axis=0)
+    x = x.reshape((-1,) + (1,) * (y.ndim - 1))
+
+    def window_sums(a):
+        total = np.concatenate((np.zeros((1,) + a.shape[1:]), np.cumsum(a, axis=0)))
+        return total[window:window + n_windows] - total[:n_windows]
+
+    sx = window_sums(x)
+    sxx = window_sums(x * x) - sx**2 / window
+    sxy = window_sums(x * y) - sx * window_sums(y) / window
+    return sxy / sxx
+
+
+def diffusion_coefficient(target_times, msd_samples, dim, window):
+    """
+    Time-dependent diffusion coefficient D(t) = (d MSD / dt) / (2 dim) from MSD samples at target_times
+    msd_samples is an (n_targets, n_traj) array as returned by sample.sample_msd; the slope is a sliding
+    window least-squares fit over window target times, so results are given at target_times[:-window]
+    Returns D(t) of the ensemble mean MSD and its standard error over trajectories
+    """
+    msd_samples = np.asarray(msd_samples, dtype=float)
+    n_traj = msd_samples.shape[1]
+    diffusion = window_slope(target_times, msd_samples, window) / (2 * dim)
+    # The windowed slope is linear in the data, so the slope of the mean is the mean of per-trajectory slopes
+    mean = np.mean(diffusion, axis=1)
+    sem = np.std(diffusion, axis=1, ddof=1) / np.sqrt(n_traj) if n_traj > 1 else np.full(len(mean), np.nan)
+    return mean, sem
@@ -0,0 +1,150 @@
+"""
+Process Pool Drivers for running many KMC trajectories in parallel
+Every trajectory gets its own random stream spawned from a single seed so results do not depend on the worker count
+Written By: Amro Dodin
+"""
+
+import copy
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+
+from kmcGrid import kmc
+from kmcGrid.checkpoint import landscape, load_snapshot, restore_landscape, save_snapshot
+from kmcGrid.trajectory import TrajectoryWriter, open_store
+
+# Per-process copy of the lattice, sent once when each worker starts
+_worker_lattice = None
+
+
+def _init_worker(lattice):
+    global _worker_lattice
+    _worker_lattice = lattice
+
+
+def _run_chunk(s0, tau, seeds, shuffle, target_times):
+    """ Runs one trajectory per seed on the worker lattice, reshuffling the landscape first if requested """
+    state_trajectories = []
+    time_trajectories = []
+    for seed in seeds:
+        rng = np.random.default_rng(seed)
+        if shuffle:
+            _worker_lattice.shuffle(rng)
+        if target_times is None:
+            states, times = kmc.run(s0, _worker_lattice, tau, rng)
+            time_trajectories.append(times)
+        else:
+            states = kmc.run(s0, _worker_lattice, tau, rng, target_times)
+        state_trajectories.append(states)
+    return state_trajectories, time_trajectories
+
+
+def spawn_seeds(seed, num_traj):
+    """ Independent per-trajectory seed sequences spawned from a single seed (int, SeedSequence or None) """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return seed.spawn(num_traj)
+
+
+def _merge(results, target_times, writer):
+    """ Collects chunk results in trajectory order, streaming them to writer as they finish if one is given """
+    state_trajectories = []
+    time_trajectories = []
+    for states, times in results:
+        if writer is None:
+            state_trajectories.extend(states)
+            time_trajectories.extend(times)
+        else:
+            for s, t in zip(states, times):
+                writer.append_states(s, t)
+    if writer is not None:
+        return writer
+    if target_times is not None:
+        return np.array(state_trajectories)
+    return state_trajectories, time_trajectories
+
+
+# Run settings, seed and landscape of a checkpointed run_parallel, next to its trajectory store
+_RUN = 'run.npz'
+
+
+def _resume(checkpoint, lattice, seed, tau, num_traj, shuffle):
+    """
+    Opens or creates the checkpoint directory of run_parallel. Returns a writer appending to its trajectory store
+    and the root seed sequence, restoring the lattice landscape and the seed of an earlier interrupted run
+    """
+    run_file = os.path.join(checkpoint, _RUN)
+    if os.path.exists(run_file):
+        run = load_snapshot(run_file)
+        assert run['tau'] == tau and run['num_traj'] == num_traj and run['shuffle'] == shuffle
+        restore_landscape(lattice, run)
+        root = np.random.SeedSequence(int(str(run['entropy'])), spawn_key=tuple(run['spawn_key']))
+        return TrajectoryWriter(checkpoint, mode='a'), root
+    root = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    writer = TrajectoryWriter(checkpoint, lattice.size, periodic=getattr(lattice, 'periodic', False))
+    # The entropy is a large python int, so it is kept as a string
+    save_snapshot(run_file, tau=tau, num_traj=num_traj, shuffle=shuffle, entropy=np.array(str(root.entropy)),
+                  spawn_key=np.array(root.spawn_key, dtype=np.int64), **landscape(lattice))
+    return writer, root
+
+
+def worker_pool(lattice, n_workers=None):
+    """
+    Process pool whose workers each hold a copy of lattice, for reuse across several run_parallel calls
+    on the same lattice so that the pool is started and the lattice sent only once. Use as a context manager
+    """
+    return ProcessPoolExecutor(n_workers, initializer=_init_worker, initargs=(lattice,))
+
+
+def run_parallel(s0, lattice, tau, num_traj, seed=None, n_workers=None, shuffle=False, chunk_size=None,
+                 target_times=None, writer=None, checkpoint=None, pool=None):
+    """
+    Runs num_traj trajectories of kmc.run from s0 up to time tau across a process pool
+    If shuffle is True every trajectory runs on its own landscape realization drawn with lattice.shuffle
+    Trajectory i always uses the i-th stream spawned from seed so the merged output is identical for any n_workers
+    Returns lists of state and time trajectories in trajectory order, or if target_times is given
+    only the states at those times as an (num_traj, n_targets, dim) array
+    If a trajectory.TrajectoryWriter is given, trajectories are appended to it in order as chunks finish
+    rather than held in memory, and the writer is returned
+    If checkpoint is a directory, trajectories are written to a store there as they finish, together with the seed
+    and landscape of the run. Calling again with the same checkpoint resumes an interrupted run: finished
+    trajectories are kept and only the rest are run. The completed store is returned memory-mapped (open_store)
+    Stores index sites on a bounded grid, so checkpoint needs a lattice with a size (not an unbounded TiledSCLattice)
+    pool may be a running worker_pool(lattice) to run on instead of starting a new pool; n_workers then only sets
+    the default chunk size. Its workers hold the lattice as it was when the pool started
+    """
+    assert writer is None or target_times is None
+    assert checkpoint is None or (writer is None and target_times is None and lattice.size is not None)
+    # A resumed checkpoint may restore the landscape, which the workers of an existing pool would not see
+    assert pool is None or checkpoint is None
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    if checkpoint is not None:
+        writer, seed = _resume(checkpoint, lattice, seed, tau, num_traj, shuffle)
+    seeds = spawn_seeds(seed, num_traj)
+    done = 0 if checkpoint is None else writer.n_traj
+    if chunk_size is None:
+        chunk_size = max(1, num_traj // (4 * n_workers))
+    chunks = [seeds[i:i + chunk_size] for i in range(done, num_traj, chunk_size)]
+
+    if pool is not None:
+        results = pool.map(_run_chunk, repeat(s0), repeat(tau), chunks, repeat(shuffle), repeat(target_times))
+        merged = _merge(results, target_times, writer)
+    elif n_workers == 1:
+        _init_worker(copy.deepcopy(lattice) if shuffle else lattice)
+        try:
+            results = (_run_chunk(s0, tau, chunk, shuffle, target_times) for chunk in chunks)
+            merged = _merge(results, target_times, writer)
+        finally:
+            # Do not keep the lattice and its tables alive between serial calls
+            _init_worker(None)
+    else:
+        with worker_pool(lattice, n_workers) as pool:
+            results = pool.map(_run_chunk, repeat(s0), repeat(tau), chunks, repeat(shuffle), repeat(target_times))
+            merged = _merge(results, target_times, writer)
+    if checkpoint is None:
+        return merged
+    writer.close()
+    return open_store(checkpoint)
@@ -1,15 +1,18 @@
 """
 Static Plotting for print-friendly visualization of KMC simulation data
+Trajectories may be passed as lists or as a PackedTrajectories store (e.g. from trajectory.open_store)
+with time_trajectories set to None. To share sampled MSDs between several plots, pack the trajectories once
+(trajectory.pack) and pass the store with the same cache.SampleCache as cache
 Written By: Amro Dodin
 """
 
 import numpy as np
-import matplotlib as mpl; mpl.use('TkAgg')
+import matplotlib as mpl
 import matplotlib.pyplot as plt
 
 from kmcGrid import sample as smp
 from kmcGrid.observables import window_slope
-from _plot_defaults import fig_spec, font_spec, axis_rect
+from kmcGrid._plot_defaults import fig_spec, font_spec, axis_rect
 
 # Set Default Font Parameters
 mpl.rc('font', **font_spec)
@@ -59,8 +62,8 @@ def plot_2d_lattice(lattice, line_increment=None, axis_scale=(1, 1), axis_units=
 
 def plot_rmsd_trajectories(s0, state_trajectories, time_trajectories, target_times, num_plotted=3,
                            figkwargs=fig_spec, axis_rect=axis_rect,
-                           linekwargs={'linewidth': 3.}, fname=None):
-    timed_samples = smp.sample_msd(s0, state_trajectories, time_trajectories, target_times)
+                           linekwargs={'linewidth': 3.}, fname=None, cache=None):
+    timed_samples = smp.sample_msd(s0, state_trajectories, time_trajectories, target_times, cache)
     fig = plt.figure(**figkwargs)
     ax = fig.add_axes(axis_rect)
     t_space = int(len(target_times)/num_plotted)
@@ -81,41 +84,85 @@ def plot_rmsd_trajectories(s0, state_trajectories, time_trajectories, target_tim
 
 
 def plot_mean_msd(s0, state_trajectories, time_trajectories, target_times, ave_window=None,
-                  figkwargs=fig_spec, axis_rect=axis_rect, fname=None, slope_fname=None, target_axes=None):
-    timed_samples = smp.sample_msd(s0, state_trajectories, time_trajectories, target_times)
+                  figkwargs=fig_spec, axis_rect=axis_rect, fname=None, slope_fname=None, target_axes=None,
+                  cache=None, label=None):
+    timed_samples = smp.sample_msd(s0, state_trajectories, time_trajectories, target_times, cache)
     mean_samples = np.mean(timed_samples, axis=1)
-
+    axes = _plot_msd_curves(target_times, mean_samples, ave_window, figkwargs, axis_rect, target_axes, label)
+    return _finish_msd_axes(axes, fname, slope_fname)
+
+
+def plot_sweep_msd(result, ave_window=None, figkwargs=fig_spec, axis_rect=axis_rect, fname=None, slope_fname=None,
+                   target_axes=None, label_keys=None):
+    """ Overlays the mean MSD (and windowed slopes if ave_window is given) of every point of a sweep.SweepResult """
+    ax1, ax2 = target_axes if type(target_axes) is tuple else (target_axes, None)
+    for i in range(len(result)):
+        axes = _plot_msd_curves(result.target_times, result.mean_msd(i), ave_window, figkwargs, axis_rect,
+                                (ax1, ax2), result.label(i, label_keys))
+        ax1, ax2 = axes if type(axes) is tuple else (axes, None)
+    ax1.legend()
+    if ax2 is not None:
+        ax2.legend()
+    return _finish_msd_axes(axes, fname, slope_fname)
+
+
+def _plot_msd_curves(target_times, mean_samples, ave_window, figkwargs, axis_rect, target_axes, label):
+    """ Plots a mean MSD curve and, if ave_window is given, its windowed slope. Returns ax1 or (ax1, ax2) """
     if target_axes is None:
         ax1 = None
         ax2 = None
     elif type(target_axes) is tuple:
         ax1 = target_axes[0]
         ax2 = target_axes[1]
+    else:
+        ax1 = target_axes
+        ax2 = None
 
     if ax1 is None:
         fig1 = plt.figure(**figkwargs)
         ax1 = fig1.add_axes(axis_rect)
-    else:
-        fig1 = ax1.figure
-    ax1.plot(target_times, mean_samples)
-
-    if fname is not None:
-        fig1.savefig(fname)
+    ax1.plot(target_times, mean_samples, label=label)
 
     if ave_window is None:
-        plt.show()
         return ax1
 
     if ax2 is None:
         fig2 = plt.figure(**figkwargs)
         ax2 = fig2.add_axes(axis_rect)
-    else:
-        fig2 = ax2.figure
     slopes = window_slope(target_times, mean_samples, ave_window)
-    ax2.plot(target_times[0:-ave_window], slopes)
+    ax2.plot(target_times[0:-ave_window], slopes, label=label)
+    return ax1, ax2
+
 
-    if slope_fname is not None:
-        fig2.savefig(slope_fname)
+def _finish_msd_axes(axes, fname, slope_fname):
+    if type(axes) is tuple:
+        ax1, ax2 = axes
+        if slope_fname is not None:
+            ax2.figure.savefig(slope_fname)
+    else:
+        ax1 = axes
+    if fname is not None:
+        ax1.figure.savefig(fname)
+    plt.show()
+    return axes
 
+
+def plot_diffusion_coefficient(s0, state_trajectories, time_trajectories, target_times, window,
+                               figkwargs=fig_spec, axis_rect=axis_rect, linekwargs={'linewidth': 3.},
+                               fname=None, target_axes=None, cache=None):
+    """ Plots the time-dependent diffusion coefficient D(t) with a band of one standard error over trajectories """
+    diffusion, sem = smp.sample_diffusion_coefficient(s0, state_trajectories, time_trajectories, target_times,
+                                                      window, cache)
+    times = target_times[0:-window]
+    if target_axes is None:
+        fig = plt.figure(**figkwargs)
+        ax = fig.add_axes(axis_rect)
+    else:
+        ax = target_axes
+        fig = ax.figure
+    lines = ax.plot(times, diffusion, **linekwargs)
+    ax.fill_between(times, diffusion - sem, diffusion + sem, color=lines[0].get_color(), alpha=0.3)
+    if fname is not None:
+        fig.savefig(fname)
     plt.show()
-    return ax1, ax2
+    return ax
@@ -5,52 +5,121 @@ Written By: Amro Dodin
 """
 
 import numpy as np
-from kmcGrid.observables import calculate_msd, calculate_rmsd
+from kmcGrid.observables import calculate_msd, calculate_rmsd, diffusion_coefficient
+from kmcGrid.trajectory import pack
+
+
+def _count_sites(sites, size):
+    """ Histograms flat site indices of shape (n_targets, n_traj) into counts of shape (n_targets, *size) """
+    n_targets = len(sites)
+    n_sites = int(np.prod(size))
+    counts = np.bincount((np.arange(n_targets)[:, np.newaxis] * n_sites + sites).ravel(),
+                         minlength=n_targets * n_sites)
+    return counts.reshape((n_targets,) + tuple(size)).astype(float)
 
 
 def sample_trajectories(state_trajectories, time_trajectories, target_times, lattice):
-    """ Samples Trajectories contained in lists state_trajectories, time_trajectories in lattice at target_times """
-    counts = []
-    for t in target_times:
-        count = np.zeros(lattice.size)
-        for ss, ts in zip(state_trajectories, time_trajectories):
-            index = np.argmax(t <= ts)
-            if index == 0:
-                index = 1
-            index = index - 1
-            count[ss[index]] += 1
-        counts.append(count)
-    return counts
-
-
-def sample_observable(state_trajectories, time_trajectories, target_times, calculate_observable, observable_kwargs={}):
+    """
+    Samples Trajectories contained in lists state_trajectories, time_trajectories in lattice at target_times
+    state_trajectories may also be a PackedTrajectories store (e.g. from trajectory.open_store),
+    in which case time_trajectories is ignored
+    Returns site counts of shape (n_targets, *lattice.size)
+    """
+    packed = pack(state_trajectories, time_trajectories, lattice.size)
+    index = packed.sample_indices(target_times)
+    return _count_sites(packed.sites_at(index), lattice.size)
+
+
+def sample_observable(state_trajectories, time_trajectories, target_times, calculate_observable, observable_kwargs={},
+                      cache=None):
     """
     Samples Observables along state_trajectories, time_trajectories at target_times
     calculate_observable is a function that calculates the desired observable and observable_kwargs are its kwargs
+    It is evaluated only on the sampled states so it must act pointwise along a trajectory, like calculate_msd
+    state_trajectories may also be a PackedTrajectories store (e.g. from trajectory.open_store),
+    in which case time_trajectories is ignored
+    Returns an (n_targets, n_traj) array of samples
+    If a cache.SampleCache is given, previously sampled grids are reused and returned read-only. Pass a store packed
+    once (trajectory.pack) rather than lists, so that the trajectories are not repacked and rehashed on every call
+    """
+    packed = pack(state_trajectories, time_trajectories)
+    if cache is not None:
+        key = cache.key(packed, target_times, calculate_observable, observable_kwargs)
+        samples = cache.get(key)
+        if samples is not None:
+            return samples
+    index = packed.sample_indices(target_times)
+    samples = calculate_observable(state_trajectory=packed.states_at(index), **observable_kwargs)
+    if cache is not None:
+        samples = cache.put(key, samples)
+    return samples
+
+
+def count_timed_states(timed_states, lattice):
+    """
+    Site counts at each target time from states streamed by kmc.run(..., target_times=...)
+    timed_states has shape (n_traj, n_targets, dim). Returns counts of shape (n_targets, *lattice.size)
+    """
+    sites = np.ravel_multi_index(np.moveaxis(np.asarray(timed_states), -1, 0), lattice.size, mode='wrap')
+    return _count_sites(sites.T, lattice.size)
+
+
+def sample_timed_observable(timed_states, calculate_observable, observable_kwargs={}):
     """
-    # Calculate MSD along each trajectory
-    observable_trajectories = []
-    for s_traj in state_trajectories:
-        observable_trajectories.append(calculate_observable(state_trajectory=s_traj, **observable_kwargs))
-
-    # Find MSD distribution at each target time
-    observable_samples = []
-    for t in target_times:
-        timed_samples = []
-        for ms, ts in zip(observable_trajectories, time_trajectories):
-            index = np.argmax(t <= ts)
-            if index == 0:
-                index = 1
-            index = index - 1
-            timed_samples.append(ms[index])
-        observable_samples.append(timed_samples)
-    return observable_samples
+    Observable samples from states streamed by kmc.run(..., target_times=...) of shape (n_traj, n_targets, dim)
+    Returns an (n_targets, n_traj) array laid out like sample_observable
+    """
+    observables = calculate_observable(state_trajectory=np.asarray(timed_states), **observable_kwargs)
+    return np.transpose(observables)
+
+
+def accumulate_observable(state_trajectories, time_trajectories, target_times, calculate_observable,
+                          observable_kwargs={}, accumulators=(), chunk_size=1024):
+    """
+    Folds samples of an observable at target_times into statistics.py accumulators chunk_size trajectories at a time
+    Only one chunk of samples is held at once, so memory does not grow with the number of trajectories
+    state_trajectories may also be a PackedTrajectories store, in which case time_trajectories is ignored
+    """
+    packed = pack(state_trajectories, time_trajectories)
+    for a, b, index in packed.iter_sample_indices(target_times, chunk_size):
+        samples = calculate_observable(state_trajectory=packed.states_at(index), **observable_kwargs)
+        for accumulator in accumulators:
+            accumulator.add(samples)
+    return accumulators
+
+
+def iter_trajectory_counts(state_trajectories, time_trajectories, target_times, lattice, block=64):
+    """
+    Yields the site counts of sample_trajectories one target time at a time
+    Target times are sampled block at a time, so memory does not grow with the number of frames
+    """
+    packed = pack(state_trajectories, time_trajectories, lattice.size)
+    for k in range(0, len(target_times), block):
+        sites = packed.sites_at(packed.sample_indices(target_times[k:k + block]))
+        for frame in sites:
+            yield _count_sites(frame[np.newaxis], lattice.size)[0]
+
+
+def iter_observable_samples(state_trajectories, time_trajectories, target_times, calculate_observable,
+                            observable_kwargs={}, block=64):
+    """ Yields the per-trajectory samples of sample_observable one target time at a time """
+    packed = pack(state_trajectories, time_trajectories)
+    for k in range(0, len(target_times), block):
+        index = packed.sample_indices(target_times[k:k + block])
+        for frame in calculate_observable(state_trajectory=packed.states_at(index), **observable_kwargs):
+            yield frame
 
 
 # Sample Functions to show how to use sample_observable
-def sample_msd(s0, state_trajectories, time_trajectories, target_times):
-    return sample_observable(state_trajectories, time_trajectories, target_times, calculate_msd, {'s0': s0})
+def sample_msd(s0, state_trajectories, time_trajectories, target_times, cache=None):
+    return sample_observable(state_trajectories, time_trajectories, target_times, calculate_msd, {'s0': s0}, cache)
+
+
+def sample_rmsd(s0, state_trajectories, time_trajectories, target_times, cache=None):
+    return sample_observable(state_trajectories, time_trajectories, target_times, calculate_rmsd, {'s0': s0}, cache)
 
 
-def sample_rmsd(s0, state_trajectories, time_trajectories, target_times):
-    return sample_observable(state_trajectories, time_trajectories, target_times, calculate_rmsd, {'s0': s0})
\ No newline at end of file
+def sample_diffusion_coefficient(s0, state_trajectories, time_trajectories, target_times, window, cache=None):
+    """ D(t) and its standard error at target_times[:-window] from windowed slopes of the sampled MSD """
+    msd = sample_msd(s0, state_trajectories, time_trajectories, target_times, cache)
+    return diffusion_coefficient(target_times, msd, len(s0), window)
@@ -0,0 +1,165 @@
+"""
+Online Accumulators for Ensemble Statistics at target times
+Trajectories are folded in one (or one batch) at a time and accumulators from different workers can be merged
+Samples follow the sample.py layout: axis 0 is the target time and an optional axis 1 runs over trajectories
+Written By: Amro Dodin
+"""
+
+import numpy as np
+
+
+def _as_batch(samples):
+    """ Views samples of shape (n_targets,) or (n_targets, n_batch) as (n_targets, n_batch) """
+    samples = np.asarray(samples, dtype=float)
+    if samples.ndim == 1:
+        samples = samples[:, np.newaxis]
+    return samples
+
+
+class RunningMoments:
+    """ Welford running mean and variance of an observable at each of n_targets target times """
+    def __init__(self, n_targets):
+        self.count = 0
+        self.mean = np.zeros(n_targets)
+        self._m2 = np.zeros(n_targets)
+
+    def add(self, samples):
+        """ Folds in samples of shape (n_targets,) for one trajectory or (n_targets, n_batch) for a batch """
+        samples = _as_batch(samples)
+        n = samples.shape[1]
+        if n == 0:
+            return
+        mean = np.mean(samples, axis=1)
+        m2 = np.sum((samples - mean[:, np.newaxis])**2, axis=1)
+        self._combine(n, mean, m2)
+
+    def merge(self, other):
+        """ Folds in the statistics of another RunningMoments, e.g. from another worker """
+        if other.count > 0:
+            self._combine(other.count, other.mean, other._m2)
+
+    def _combine(self, n, mean, m2):
+        # Chan et al. pairwise update, which reduces to Welford's update for a single sample
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * n / total
+        self._m2 = self._m2 + m2 + delta**2 * self.count * n / total
+        self.count = total
+
+    @property
+    def variance(self):
+        """ Unbiased sample variance at each target time """
+        if self.count < 2:
+            return np.full_like(self.mean, np.nan)
+        return self._m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    @property
+    def sem(self):
+        """ Standard error of the mean at each target time """
+        return self.std / np.sqrt(self.count)
+
+
+class RunningHistogram:
+    """ Fixed-bin histograms of an observable at each of n_targets target times. bins are the bin edges """
+    def __init__(self, n_targets, bins):
+        self.bins = np.asarray(bins, dtype=float)
+        self.counts = np.zeros((n_targets, len(self.bins) - 1), dtype=np.int64)
+
+    def add(self, samples):
+        """ Folds in samples of shape (n_targets,) or (n_targets, n_batch). Out of range samples are dropped """
+        samples = _as_batch(samples)
+        n_targets, n_bins = self.counts.shape
+        # Bins are half open except the last, which includes its right edge as in np.histogram
+        index = np.searchsorted(self.bins, samples, side='right') - 1
+        index[samples == self.bins[-1]] = n_bins - 1
+        valid = (index >= 0) & (index < n_bins)
+        target = np.broadcast_to(np.arange(n_targets)[:, np.newaxis], samples.shape)
+        flat = target[valid] * n_bins + index[valid]
+        self.counts += np.bincount(flat, minlength=n_targets * n_bins).reshape(n_targets, n_bins)
+
+    def merge(self, other):
+        assert np.array_equal(self.bins, other.bins)
+        self.counts += other.counts
+
+    def density(self):
+        """ Normalized histograms at each target time, matching np.histogram(..., density=True) """
+        widths = np.diff(self.bins)
+        totals = np.sum(self.counts, axis=1, keepdims=True)
+        return self.counts / (totals * widths)
+
+
+class PopulationCounter:
+    """ Per-site population counts on a lattice of shape size at each of n_targets target times """
+    def __init__(self, n_targets, size):
+        self.size = tuple(size)
+        self.count = 0
+        self.counts = np.zeros((n_targets,) + self.size)
+
+    def add(self, timed_states):
+        """
+        Folds in the states of one trajectory at the target times, shape (n_targets, dim),
+        or of a batch as returned by kmc.run_ensemble(..., target_times=...), shape (n_batch, n_targets, dim)
+        """
+        timed_states = np.asarray(timed_states)
+        if timed_states.ndim == 2:
+            timed_states = timed_states[np.newaxis]
+        n_targets = len(self.counts)
+        n_sites = int(np.prod(self.size))
+        sites = np.ravel_multi_index(np.moveaxis(timed_states, -1, 0), self.size, mode='wrap')
+        flat = (np.arange(n_targets) * n_sites + sites).ravel()
+        self.counts += np.bincount(flat, minlength=n_targets * n_sites).reshape(self.counts.shape)
+        self.count += len(timed_states)
+
+    def merge(self, other):
+        assert self.size == other.size
+        self.counts += other.counts
+        self.count += other.count
+
+    def populations(self):
+        """ Site occupation probabilities at each target time """
+        return self.counts / self.count
+
+
+class OccupancyAccumulator:
+    """
+    Per-site occupancy on a lattice of shape size filled in by the run loops (kmc.run(..., occupancy=...))
+    counts (n_targets, *size) holds how many trajectories sat on each site at each target time, using the
+    sample.py convention, so it equals sample.sample_trajectories over the same trajectories
+    dwell (*size) holds the total time spent on each site, i.e. the time integral of the occupancy
+    """
+    def __init__(self, target_times, size):
+        self.target_times = np.asarray(target_times, dtype=float)
+        self.size = tuple(size)
+        self.count = 0
+        self.total_time = 0.
+        self.counts = np.zeros((len(self.target_times),) + self.size)
+        self.dwell = np.zeros(self.size)
+
+    @property
+    def flat_counts(self):
+        """ View of counts indexed by (target, flat site index) """
+        return self.counts.reshape(len(self.target_times), -1)
+
+    @property
+    def flat_dwell(self):
+        """ View of dwell indexed by flat site index """
+        return self.dwell.reshape(-1)
+
+    def merge(self, other):
+        assert self.size == other.size and np.array_equal(self.target_times, other.target_times)
+        self.counts += other.counts
+        self.dwell += other.dwell
+        self.count += other.count
+        self.total_time += other.total_time
+
+    def populations(self):
+        """ Site occupation probabilities at each target time """
+        return self.counts / self.count
+
+    def time_fractions(self):
+        """ Fraction of the total simulated time spent on each site """
+        return self.dwell / self.total_time
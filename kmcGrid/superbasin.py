@@ -0,0 +1,131 @@
+"""
+First-Passage Acceleration for walkers trapped in small sets of deep sites
+A trapped walker's exit is drawn in one step from the exact exit time and exit hop distribution of the basin
+treated as an absorbing Markov chain
+Written By: Amro Dodin
+"""
+
+from collections import deque
+
+import numpy as np
+
+
+class TrapAccelerator:
+    """
+    Watches the last window hops of a walker on an indexed lattice. Once they all stay within at most max_sites
+    distinct sites, those sites are treated as a basin and the walker leaves it in a single exact jump
+    """
+    def __init__(self, lattice, window=64, max_sites=4):
+        self.lattice = lattice
+        self.window = window
+        self.max_sites = max_sites
+        self.basins_exited = 0
+        # Basin site the walker occupied at the end of the last escape: its exit site's source, or its site at t_max
+        self.last_site = None
+        self.reset()
+
+    def reset(self):
+        self._recent = deque()
+        self._counts = {}
+
+    def observe(self, site):
+        """ Records a visit to site. Returns the basin sites if the walker is trapped, otherwise None """
+        self._recent.append(site)
+        self._counts[site] = self._counts.get(site, 0) + 1
+        if len(self._recent) > self.window:
+            old = self._recent.popleft()
+            self._counts[old] -= 1
+            if self._counts[old] == 0:
+                del self._counts[old]
+        if len(self._recent) == self.window and len(self._counts) <= self.max_sites:
+            return list(self._counts)
+        return None
+
+    def escape(self, basin, site, t_max, rng):
+        """
+        Exact escape of a walker at site from basin within time t_max
+        Returns (dt, new_site, exited): the exit time and the site entered outside the basin, or, if the walker
+        is still inside after t_max, (t_max, site inside the basin at t_max, False)
+        """
+        generator, exit_rates, exit_sites = self._absorbing_chain(basin)
+        eigenvalues, vectors = np.linalg.eig(generator)
+        inverse = np.linalg.inv(vectors)
+        start = vectors[basin.index(site)]
+
+        def occupation(t):
+            """ Probability of being at each basin site at time t without having left """
+            return np.real((start * np.exp(eigenvalues * t)) @ inverse)
+
+        self.reset()
+        u = rng.random()
+        if np.sum(occupation(t_max)) > u:
+            p = np.clip(occupation(t_max), 0., None)
+            self.last_site = basin[_choose(p, rng)]
+            return t_max, self.last_site, False
+
+        # Survival probability decreases monotonically from 1, so bisect for the time it falls to u
+        low, high = 0., t_max
+        for _ in range(64):
+            mid = 0.5 * (low + high)
+            if np.sum(occupation(mid)) > u:
+                low = mid
+            else:
+                high = mid
+        dt = 0.5 * (low + high)
+
+        # Exit hop from basin site i to outside site o has density occupation_i(dt) * rate(i -> o)
+        flux = np.clip(occupation(dt)[:, np.newaxis] * exit_rates, 0., None)
+        choice = _choose(flux.ravel(), rng)
+        self.basins_exited += 1
+        self.last_site = basin[choice // exit_rates.shape[1]]
+        return dt, exit_sites[choice % exit_rates.shape[1]], True
+
+    def bridge(self, basin, site, end, dt, times, rng):
+        """
+        Basin sites held at times (sorted, within [0, dt]) by a walker that entered the stay at site and was at
+        basin site end at dt without leaving, drawn jointly from the exact Markov bridge of the basin chain
+        The site at each time is drawn given the previous one, weighted by the chance of still reaching end at dt
+        """
+        generator, _, _ = self._absorbing_chain(basin)
+        eigenvalues, vectors = np.linalg.eig(generator)
+        inverse = np.linalg.inv(vectors)
+
+        def propagator(t):
+            """ P[a, b]: probability of moving from basin site a to b within time t without leaving the basin """
+            return np.real((vectors * np.exp(eigenvalues * t)) @ inverse)
+
+        current = basin.index(site)
+        last = basin.index(end)
+        t = 0.
+        sampled = []
+        for s in times:
+            weights = np.clip(propagator(s - t)[current] * propagator(dt - s)[:, last], 0., None)
+            current = _choose(weights, rng)
+            t = s
+            sampled.append(basin[current])
+        return sampled
+
+    def _absorbing_chain(self, basin):
+        """ Sub-generator among basin sites and rates from each basin site to every outside neighbor """
+        lattice = self.lattice
+        position = {s: i for i, s in enumerate(basin)}
+        rates = np.diff(lattice.cum_rates[basin], axis=1, prepend=0.)
+        neighbors = lattice.neighbor_table[basin]
+        generator = np.diag(-lattice.cum_rates[basin, -1])
+        exit_sites = sorted({n for n in neighbors.ravel().tolist() if n >= 0 and n not in position})
+        exit_position = {s: j for j, s in enumerate(exit_sites)}
+        exit_rates = np.zeros((len(basin), len(exit_sites)))
+        for i in range(len(basin)):
+            for n, k in zip(neighbors[i].tolist(), rates[i]):
+                if n < 0:
+                    continue
+                if n in position:
+                    generator[i, position[n]] += k
+                else:
+                    exit_rates[i, exit_position[n]] += k
+        return generator, exit_rates, exit_sites
+
+
+def _choose(weights, rng):
+    cumulative = np.cumsum(weights)
+    return int(np.searchsorted(cumulative, rng.random() * cumulative[-1], side='right'))
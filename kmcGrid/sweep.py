@@ -0,0 +1,132 @@
+"""
+Parameter Sweeps over many landscape parameter points on one process pool
+Every (point, chunk of trajectories) pair is a task for the same pool, so workers stay busy across the whole grid,
+each worker builds the lattice of a point at most once, and trajectories are sampled on a shared target time grid
+as they run so no trajectory is ever stored. Points on the same grid size reuse a worker's lattice by retargeting
+its rate table, and with common random numbers every point sees the same landscapes and hop random streams
+Written By: Amro Dodin
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product, repeat
+
+import numpy as np
+
+from kmcGrid import kmc
+from kmcGrid.lattice import SCLattice
+from kmcGrid.observables import calculate_msd
+from kmcGrid.parallel import spawn_seeds
+from kmcGrid.statistics import RunningMoments
+
+# Lattice of the last parameter point run by this process and the seed of its landscape
+_worker_lattice = {}
+
+
+def parameter_grid(std_energy, temp, rate, size):
+    """ Every combination of the given std_energy, temp, rate and size values as a list of parameter dicts """
+    return [{'std_energy': e, 'temp': t, 'rate': r, 'size': tuple(s)}
+            for e, t, r, s in product(std_energy, temp, rate, size)]
+
+
+def _point_lattice(point, landscape_seed):
+    """
+    Lattice of a parameter point with its landscape drawn from landscape_seed. If this worker's last lattice has
+    the same size and landscape seed it is retargeted to the point's parameters instead of being rebuilt
+    """
+    seed_key = (landscape_seed.entropy, landscape_seed.spawn_key)
+    lattice = _worker_lattice.get('lattice')
+    if (lattice is not None and lattice.size == point['size'] and _worker_lattice['seed'] == seed_key
+            and lattice.std_energy != 0):
+        lattice.retarget(point['temp'], point['rate'], point['std_energy'])
+        return lattice
+    lattice = SCLattice(point['size'], point['std_energy'], point['rate'], point['temp'])
+    lattice.shuffle(np.random.default_rng(landscape_seed))
+    _worker_lattice['lattice'] = lattice
+    _worker_lattice['seed'] = seed_key
+    return lattice
+
+
+def _center(size):
+    return tuple(int(s / 2) for s in size)
+
+
+def _run_point_chunk(point, landscape_seed, s0, tau, seeds, shuffle, target_times):
+    """ Runs one trajectory per seed at a parameter point and folds their MSD at target_times into RunningMoments """
+    lattice = _point_lattice(point, landscape_seed)
+    if s0 is None:
+        s0 = _center(point['size'])
+    moments = RunningMoments(len(target_times))
+    for seed in seeds:
+        rng = np.random.default_rng(seed)
+        if shuffle:
+            lattice.shuffle(rng)
+        states = kmc.run(s0, lattice, tau, rng, target_times)
+        moments.add(calculate_msd(s0, states))
+    return moments
+
+
+class SweepResult:
+    """
+    MSD statistics of a parameter sweep. points[i] is the parameter dict of point i and moments[i]
+    the statistics.RunningMoments of its MSD at target_times over the trajectories run at that point
+    """
+    def __init__(self, points, target_times, moments):
+        self.points = points
+        self.target_times = target_times
+        self.moments = moments
+
+    def __len__(self):
+        return len(self.points)
+
+    def mean_msd(self, i):
+        return self.moments[i].mean
+
+    def sem_msd(self, i):
+        return self.moments[i].sem
+
+    def label(self, i, keys=None):
+        """ Legend label of point i listing the parameters in keys (default: those that vary across the sweep) """
+        if keys is None:
+            keys = [k for k in self.points[0] if any(p[k] != self.points[0][k] for p in self.points)]
+        return ', '.join('{}={:g}'.format(k, self.points[i][k]) if np.isscalar(self.points[i][k])
+                         else '{}={}'.format(k, self.points[i][k]) for k in keys)
+
+
+def run_sweep(points, tau, num_traj, target_times, s0=None, seed=None, n_workers=None, shuffle=True,
+              chunk_size=None, common_random_numbers=False):
+    """
+    Runs num_traj trajectories from s0 up to time tau at every parameter point (see parameter_grid) on one pool
+    s0 defaults to the centre of each point's lattice. With shuffle every trajectory gets its own landscape
+    Trajectory j of point i uses the j-th stream spawned from the i-th child of seed, so the same trajectories
+    are run for any n_workers or chunk_size. Without shuffle each point runs on one landscape drawn from its seed
+    With common_random_numbers every point uses the streams of the first child instead, so trajectory j sees the
+    same (rescaled) landscape and the same random numbers at every point. Differences between points then have
+    much lower variance than their separate errors suggest. Returns a SweepResult
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    if chunk_size is None:
+        chunk_size = max(1, len(points) * num_traj // (4 * n_workers))
+    # The first num_traj children of a point seed drive its trajectories and the next one its fixed landscape
+    point_streams = [spawn_seeds(s, num_traj + 1) for s in spawn_seeds(seed, len(points))]
+    if common_random_numbers:
+        point_streams = [point_streams[0]] * len(points)
+    tasks = [(i, streams[a:min(a + chunk_size, num_traj)])
+             for i, streams in enumerate(point_streams)
+             for a in range(0, num_traj, chunk_size)]
+    index = [i for i, _ in tasks]
+    args = ([points[i] for i in index], [point_streams[i][num_traj] for i in index], repeat(s0), repeat(tau),
+            [chunk for _, chunk in tasks], repeat(shuffle), repeat(target_times))
+
+    moments = [RunningMoments(len(target_times)) for _ in points]
+    if n_workers == 1:
+        results = map(_run_point_chunk, *args)
+        for i, chunk_moments in zip(index, results):
+            moments[i].merge(chunk_moments)
+        _worker_lattice.clear()
+    else:
+        with ProcessPoolExecutor(n_workers) as pool:
+            for i, chunk_moments in zip(index, pool.map(_run_point_chunk, *args)):
+                moments[i].merge(chunk_moments)
+    return SweepResult(points, target_times, moments)
@@ -0,0 +1,374 @@
+"""
+Packed Storage for Ragged Sets of KMC Trajectories
+States and times of all trajectories are concatenated into flat arrays with an offsets index
+Written By: Amro Dodin
+"""
+
+import json
+import os
+from itertools import chain
+
+import numpy as np
+
+
+class Trajectory:
+    """
+    Compact single trajectory of flat site indices on a lattice of shape size with their times
+    Sites are held in the smallest unsigned type that fits the lattice (see site_dtype) and times as time_dtype
+    (float32 halves their memory at about 7 significant digits), in arrays that double in capacity as they fill
+    Behaves as a sequence of lattice state tuples, and np.asarray gives the (n, dim) coordinates, so it can be used
+    wherever kmc.run's list of states is. On periodic lattices the coordinates are the unwrapped path, rebuilt on
+    each access (an index unwraps only up to that state) so that no int64 copy of the path is kept
+    """
+    __slots__ = ('size', 'periodic', '_sites', '_times', '_n')
+
+    def __init__(self, size, periodic=False, capacity=64, time_dtype=np.float64):
+        self.size = tuple(size)
+        self.periodic = periodic
+        self._sites = np.empty(capacity, dtype=site_dtype(self.size))
+        self._times = np.empty(capacity, dtype=time_dtype)
+        self._n = 0
+
+    def append(self, site, t):
+        if self._n == len(self._sites):
+            self._grow()
+        self._sites[self._n] = site
+        self._times[self._n] = t
+        self._n += 1
+
+    def _grow(self):
+        capacity = max(2 * len(self._sites), 1)
+        self._sites = np.resize(self._sites, capacity)
+        self._times = np.resize(self._times, capacity)
+
+    def trim(self):
+        """ Releases the spare capacity left by doubling, e.g. once the trajectory is complete """
+        self._sites = self._sites[:self._n].copy()
+        self._times = self._times[:self._n].copy()
+
+    @property
+    def sites(self):
+        return self._sites[:self._n]
+
+    @property
+    def times(self):
+        return self._times[:self._n]
+
+    @property
+    def nbytes(self):
+        """ Memory held by the stored hops, excluding spare capacity """
+        return self._n * (self._sites.itemsize + self._times.itemsize)
+
+    @property
+    def states(self):
+        """ Lattice coordinates of the stored states with shape (n, dim) """
+        return self._coords(self._n)
+
+    def _coords(self, end):
+        """ Coordinates of the first end states, unwrapping the path on periodic lattices """
+        if self.periodic:
+            return PackedTrajectories(self._times[:end], [0, end], sites=self._sites[:end], size=self.size,
+                                      periodic=True).states
+        return np.stack(np.unravel_index(self._sites[:end], self.size), axis=-1)
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(map(tuple, self.states[index].tolist()))
+        if index < 0:
+            index += self._n
+        if not 0 <= index < self._n:
+            raise IndexError('trajectory index out of range')
+        if self.periodic:
+            return tuple(self._coords(index + 1)[-1].tolist())
+        return tuple(int(c) for c in np.unravel_index(self._sites[index], self.size))
+
+    def __iter__(self):
+        return map(tuple, self.states.tolist())
+
+    def __array__(self, dtype=None, copy=None):
+        states = self.states
+        return states if dtype is None else states.astype(dtype)
+
+
+class PackedTrajectories:
+    """
+    Ragged set of trajectories stored as concatenated times with per-trajectory offsets
+    Trajectory i occupies entries offsets[i]:offsets[i+1]. States are held either as lattice coordinates
+    (states, shape (N, dim)) or as flat site indices of a lattice of shape size (sites); each is derived on demand
+    If periodic is True, sites are wrapped into the grid and states are the unwrapped coordinates of each path
+    """
+    def __init__(self, times, offsets, states=None, sites=None, size=None, chunk_size=None, periodic=False):
+        assert states is not None or sites is not None
+        self.times = np.asarray(times, dtype=float)
+        self.offsets = np.asarray(offsets, dtype=np.intp)
+        self.size = None if size is None else tuple(size)
+        self._states = None if states is None else np.asarray(states)
+        self._sites = None if sites is None else np.asarray(sites)
+        self.chunk_size = chunk_size
+        self.periodic = periodic
+        # Content hash set by cache.fingerprint on first use
+        self._fingerprint = None
+
+    @classmethod
+    def from_lists(cls, state_trajectories, time_trajectories, size=None):
+        """
+        Packs lists of state tuple trajectories and time trajectories as returned by kmc.run
+        If the state trajectories are compact Trajectory objects their site indices are packed directly
+        """
+        lengths = [len(s) for s in state_trajectories]
+        assert lengths == [len(t) for t in time_trajectories]
+        offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.intp)))
+        if len(state_trajectories) > 0 and all(isinstance(s, Trajectory) for s in state_trajectories):
+            first = state_trajectories[0]
+            sites = np.concatenate([s.sites for s in state_trajectories])
+            times = np.concatenate(time_trajectories)
+            return cls(times, offsets, sites=sites, size=first.size, periodic=first.periodic)
+        states = np.array(list(chain.from_iterable(state_trajectories)), dtype=np.intp)
+        times = np.concatenate(time_trajectories) if len(time_trajectories) > 0 else np.zeros(0)
+        return cls(times, offsets, states=states, size=size)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def states(self):
+        """ Lattice coordinates of all stored states with shape (N, dim) """
+        if self._states is None:
+            self._states = np.stack(np.unravel_index(self._sites, self.size), axis=-1)
+            if self.periodic:
+                self._states = self._unwrap(self._states, self.offsets)
+        return self._states
+
+    def _unwrap(self, coords, offsets):
+        """
+        Rebuilds continuous paths from wrapped coordinates using minimum image steps within each trajectory
+        offsets are the trajectory boundaries within coords, starting at 0
+        """
+        size = np.asarray(self.size)
+        steps = np.zeros_like(coords)
+        steps[1:] = np.diff(coords, axis=0)
+        steps -= size * np.round(steps / size).astype(steps.dtype)
+        lengths = np.diff(offsets)
+        starts = offsets[:-1][lengths > 0]
+        steps[starts] = coords[starts]
+        # Segmented cumulative sum: remove the running total carried over from earlier trajectories
+        total = np.cumsum(steps, axis=0)
+        carried = total[starts] - coords[starts]
+        return total - np.repeat(carried, lengths[lengths > 0], axis=0)
+
+    @property
+    def sites(self):
+        """ Flat site indices of all stored states. The lattice size is inferred from the states if unknown """
+        if self._sites is None:
+            if self.size is None:
+                self.size = tuple(int(m) + 1 for m in self._states.max(axis=0))
+            self._sites = np.ravel_multi_index(self._states.T, self.size, mode='wrap')
+        return self._sites
+
+    def states_at(self, index):
+        """
+        Coordinates of the states at positions index, without converting or caching the whole store
+        On periodic stores only the trajectories spanned by index are unwrapped
+        """
+        if self._states is not None:
+            return self._states[index]
+        if not self.periodic:
+            return np.stack(np.unravel_index(self._sites[index], self.size), axis=-1)
+        index = np.asarray(index)
+        if index.size == 0:
+            return np.zeros(index.shape + (len(self.size),), dtype=np.intp)
+        first = np.searchsorted(self.offsets, np.min(index), side='right') - 1
+        last = np.searchsorted(self.offsets, np.max(index), side='right')
+        start, end = self.offsets[first], self.offsets[last]
+        coords = np.stack(np.unravel_index(np.asarray(self._sites[start:end]), self.size), axis=-1)
+        return self._unwrap(coords, self.offsets[first:last + 1] - start)[index - start]
+
+    def sites_at(self, index):
+        """ Flat site indices of the states at positions index """
+        if self._sites is None and self.size is not None:
+            return np.ravel_multi_index(np.moveaxis(self._states[index], -1, 0), self.size, mode='wrap')
+        return self.sites[index]
+
+    def trajectory(self, i):
+        """ States (as coordinates) and times of trajectory i """
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.states[start:end], self.times[start:end]
+
+    def to_lists(self):
+        """ Unpacks into lists of state tuple trajectories and time trajectories as returned by kmc.run """
+        states = list(map(tuple, self.states.tolist()))
+        bounds = list(zip(self.offsets[:-1], self.offsets[1:]))
+        return [states[i:j] for i, j in bounds], [self.times[i:j] for i, j in bounds]
+
+    def sample_indices(self, target_times, chunk_size=None):
+        """
+        Positions into the packed arrays of the state held by every trajectory at every target time
+        Follows the sample.py convention: the state before the first hop at or after the target time.
+        Targets past the end of a trajectory see its last state. Returns an (n_targets, n_traj) array
+        Trajectories are processed chunk_size at a time to bound temporary memory. Defaults to the store's
+        chunk_size, or all trajectories at once if that is None
+        """
+        index = np.empty((len(target_times), len(self)), dtype=np.intp)
+        for a, b, chunk_index in self.iter_sample_indices(target_times, chunk_size):
+            index[:, a:b] = chunk_index
+        return index
+
+    def iter_sample_indices(self, target_times, chunk_size=None):
+        """ Yields (a, b, index) where index holds the sample_indices of trajectories a:b """
+        target_times = np.asarray(target_times, dtype=float)
+        n_traj = len(self)
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+        if chunk_size is None:
+            chunk_size = max(n_traj, 1)
+        for a in range(0, n_traj, chunk_size):
+            b = min(a + chunk_size, n_traj)
+            yield a, b, self._sample_chunk(a, b, target_times)
+
+    def _sample_chunk(self, a, b, target_times):
+        """ Single vectorized searchsorted over trajectories a:b and all target times """
+        start = self.offsets[a]
+        times = np.asarray(self.times[start:self.offsets[b]])
+        lengths = np.diff(self.offsets[a:b + 1])
+        local_offsets = self.offsets[a:b] - start
+        traj = np.repeat(np.arange(b - a), lengths)
+
+        # Replace times by their exact ranks among all times and targets then offset each trajectory by its id
+        # so one sorted key array holds every trajectory back to back
+        ranks, inverse = np.unique(np.concatenate((times, target_times)), return_inverse=True)
+        n_ranks = len(ranks)
+        keys = traj * n_ranks + inverse[:len(times)]
+        queries = np.arange(b - a) * n_ranks + inverse[len(times):, np.newaxis]
+
+        first = np.searchsorted(keys, queries, side='left') - local_offsets
+        return start + local_offsets + np.maximum(first, 1) - 1
+
+
+def pack(state_trajectories, time_trajectories=None, size=None):
+    """ Returns state_trajectories unchanged if already packed, otherwise packs the two trajectory lists """
+    if isinstance(state_trajectories, PackedTrajectories):
+        return state_trajectories
+    return PackedTrajectories.from_lists(state_trajectories, time_trajectories, size)
+
+
+# On-disk stores are directories of raw little-endian arrays that can be memory-mapped:
+#   sites.bin   flat site index of every state, in the smallest unsigned type that fits the lattice
+#   times.bin   float64 time of every state
+#   offsets.bin int64 trajectory boundaries, starting with 0 and extended once a trajectory is fully written
+#   meta.json   lattice size, site dtype and whether the lattice is periodic
+_SITES = 'sites.bin'
+_TIMES = 'times.bin'
+_OFFSETS = 'offsets.bin'
+_META = 'meta.json'
+
+
+def site_dtype(size):
+    """ Smallest unsigned integer type able to index every site of a lattice of shape size """
+    n_sites = int(np.prod(size))
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if n_sites <= np.iinfo(dtype).max + 1:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+
+class TrajectoryWriter:
+    """
+    Incrementally writes trajectories of a lattice of shape size to an on-disk store in directory path
+    mode 'w' starts a new store, mode 'a' appends to an existing one. Use as a context manager or call close()
+    Set periodic for periodic lattices so that reading the store unwraps the paths
+    """
+    def __init__(self, path, size=None, mode='w', periodic=False):
+        assert mode in ('w', 'a')
+        self.path = path
+        meta_file = os.path.join(path, _META)
+        if mode == 'a' and os.path.exists(meta_file):
+            with open(meta_file) as f:
+                meta = json.load(f)
+            self.size = tuple(meta['size'])
+            self.site_dtype = np.dtype(meta['site_dtype'])
+            self.periodic = meta.get('periodic', False)
+            offsets = np.fromfile(os.path.join(path, _OFFSETS), dtype='<i8')
+            self.n_written = int(offsets[-1])
+            self.n_traj = len(offsets) - 1
+            # Drop any partially written trajectory left behind by an interrupted writer
+            for name, dtype in ((_SITES, self.site_dtype), (_TIMES, np.dtype('<f8'))):
+                with open(os.path.join(path, name), 'r+b') as f:
+                    f.truncate(self.n_written * dtype.itemsize)
+        else:
+            assert size is not None
+            os.makedirs(path, exist_ok=True)
+            self.size = tuple(int(s) for s in size)
+            self.site_dtype = site_dtype(self.size)
+            self.periodic = periodic
+            with open(meta_file, 'w') as f:
+                json.dump({'size': self.size, 'site_dtype': self.site_dtype.str, 'periodic': periodic}, f)
+            np.zeros(1, dtype='<i8').tofile(os.path.join(path, _OFFSETS))
+            open(os.path.join(path, _SITES), 'wb').close()
+            open(os.path.join(path, _TIMES), 'wb').close()
+            self.n_written = 0
+            self.n_traj = 0
+        self._sites = open(os.path.join(path, _SITES), 'ab')
+        self._times = open(os.path.join(path, _TIMES), 'ab')
+        self._offsets = open(os.path.join(path, _OFFSETS), 'ab')
+
+    def append(self, sites, times):
+        """ Writes one trajectory given as flat site indices and times """
+        assert len(sites) == len(times)
+        np.asarray(sites).astype(self.site_dtype.newbyteorder('<')).tofile(self._sites)
+        np.asarray(times, dtype='<f8').tofile(self._times)
+        self._sites.flush()
+        self._times.flush()
+        self.n_written += len(sites)
+        self.n_traj += 1
+        np.array([self.n_written], dtype='<i8').tofile(self._offsets)
+        self._offsets.flush()
+
+    def append_states(self, states, times):
+        """ Writes one trajectory given as a list of state tuples, as returned by kmc.run """
+        sites = np.ravel_multi_index(np.asarray(states).T, self.size, mode='wrap') if len(states) > 0 else []
+        self.append(sites, times)
+
+    def extend(self, state_trajectories, time_trajectories=None):
+        """ Writes every trajectory of a PackedTrajectories store or of a pair of trajectory lists """
+        packed = pack(state_trajectories, time_trajectories, self.size)
+        sites = packed.sites
+        for i in range(len(packed)):
+            start, end = packed.offsets[i], packed.offsets[i + 1]
+            self.append(sites[start:end], packed.times[start:end])
+
+    def close(self):
+        for f in (self._sites, self._times, self._offsets):
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_store(path, chunk_size=1024):
+    """
+    Opens an on-disk store written by TrajectoryWriter as a memory-mapped PackedTrajectories
+    Only complete trajectories are visible. Sampling processes chunk_size trajectories at a time
+    """
+    with open(os.path.join(path, _META)) as f:
+        meta = json.load(f)
+    offsets = np.fromfile(os.path.join(path, _OFFSETS), dtype='<i8')
+    n_written = int(offsets[-1])
+    dtype = np.dtype(meta['site_dtype'])
+    if n_written == 0:
+        sites = np.zeros(0, dtype=dtype)
+        times = np.zeros(0)
+    else:
+        sites = np.memmap(os.path.join(path, _SITES), dtype=dtype, mode='r', shape=(n_written,))
+        times = np.memmap(os.path.join(path, _TIMES), dtype='<f8', mode='r', shape=(n_written,))
+    return PackedTrajectories(times, offsets, sites=sites, size=meta['size'], chunk_size=chunk_size,
+                              periodic=meta.get('periodic', False))
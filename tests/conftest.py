@@ -0,0 +1,42 @@
+"""
+Shared seeded lattices for the regression tests. Every test runs on tiny grids so the suite stays fast
+Run with: python -m pytest tests
+"""
+
+import numpy as np
+import pytest
+
+from kmcGrid import kmc
+from kmcGrid.lattice import SCLattice, StencilLattice
+
+S0 = (3, 3)
+TAU = 10.
+TARGET_TIMES = np.append(np.linspace(0., 8., 17), [TAU, 12.])
+
+
+def make_lattice(periodic=False):
+    """ Seeded 7x7 landscape, with walls or periodic boundaries """
+    np.random.seed(0)
+    if periodic:
+        return StencilLattice((7, 7), 0.03, 1., 300., boundary='periodic')
+    return SCLattice((7, 7), 0.03, 1., 300.)
+
+
+def run_lists(lattice, n_traj, tau=TAU, **kwargs):
+    """ Lists of state and time trajectories of n_traj seeded kmc.run calls """
+    states, times = [], []
+    for k in range(n_traj):
+        s, t = kmc.run(S0, lattice, tau, np.random.default_rng(k), **kwargs)
+        states.append(s)
+        times.append(t)
+    return states, times
+
+
+@pytest.fixture
+def lattice():
+    return make_lattice()
+
+
+@pytest.fixture
+def periodic_lattice():
+    return make_lattice(periodic=True)
@@ -0,0 +1,43 @@
+import numpy as np
+
+from kmcGrid import master
+from kmcGrid.adaptive import converged, run_converged_msd
+from kmcGrid.statistics import RunningMoments
+
+from conftest import S0
+
+TARGET_TIMES = np.array([1., 2., 4.])
+
+
+def test_runs_until_the_mean_msd_converges(lattice):
+    moments, done = run_converged_msd(S0, lattice, 4., TARGET_TIMES, rtol=0.05, batch_size=50, seed=1, n_workers=1)
+    assert done and converged(moments, 0., 0.05)
+    assert np.all(moments.sem <= 0.05 * moments.mean) and moments.count >= 50
+
+
+def test_fixed_landscape_agrees_with_master_equation(lattice):
+    moments, done = run_converged_msd(S0, lattice, 4., TARGET_TIMES, rtol=0.03, batch_size=100, seed=3, n_workers=1,
+                                      shuffle=False)
+    assert done
+    assert np.all(np.abs(moments.mean - master.mean_msd(S0, lattice, TARGET_TIMES)) <= 5 * moments.sem)
+
+
+def test_stops_at_max_traj_without_converging(lattice):
+    moments, done = run_converged_msd(S0, lattice, 4., TARGET_TIMES, rtol=1e-4, batch_size=20, max_traj=70, seed=1,
+                                      n_workers=1)
+    assert not done and moments.count == 70
+
+
+def test_results_do_not_depend_on_worker_count(lattice):
+    one, _ = run_converged_msd(S0, lattice, 4., TARGET_TIMES, rtol=0.05, batch_size=40, seed=2, n_workers=1)
+    two, _ = run_converged_msd(S0, lattice, 4., TARGET_TIMES, rtol=0.05, batch_size=40, seed=2, n_workers=2)
+    assert one.count == two.count
+    assert np.array_equal(one.mean, two.mean) and np.array_equal(one.variance, two.variance)
+
+
+def test_converged_needs_two_samples():
+    moments = RunningMoments(1)
+    moments.add(np.array([[1.]]))
+    assert not converged(moments, 1., 1.)
+    moments.add(np.array([[1.]]))
+    assert converged(moments, 0., 0.)
@@ -0,0 +1,37 @@
+import matplotlib.image
+import numpy as np
+from PIL import Image
+
+from kmcGrid import animate, sample
+from kmcGrid.observables import calculate_msd
+
+from conftest import S0, TARGET_TIMES, run_lists
+
+# A few low resolution frames keep the rendering cheap
+FRAME_TIMES = TARGET_TIMES[::4]
+
+
+def test_render_populations_writes_one_image_per_frame(lattice, tmp_path):
+    states, times = run_lists(lattice, 8)
+    frames = list(sample.iter_trajectory_counts(states, times, FRAME_TIMES, lattice, block=3))
+    images = []
+    for prefetch in (True, False):
+        path = str(tmp_path / f'{prefetch}_{{:03d}}.png')
+        assert animate.render_populations(iter(frames), lattice, path, num_traj=8, dpi=20,
+                                          prefetch=prefetch) == path
+        images.append([matplotlib.image.imread(path.format(k)) for k in range(len(frames))])
+    assert not (tmp_path / f'True_{len(frames):03d}.png').exists()
+    # Prefetching keeps the frame order and the walkers spread out from S0 over time
+    for a, b in zip(*images):
+        assert np.array_equal(a, b)
+    assert not np.array_equal(images[0][0], images[0][-1])
+
+
+def test_render_observable_histograms_writes_gif(lattice, tmp_path):
+    states, times = run_lists(lattice, 8)
+    frames = list(sample.iter_observable_samples(states, times, FRAME_TIMES, calculate_msd, {'s0': S0}))
+    path = str(tmp_path / 'msd.gif')
+    animate.render_observable_histograms(frames, np.linspace(0., 20., 11), path, observable_name='MSD', dpi=20)
+    with Image.open(path) as gif:
+        assert gif.n_frames > 1
+        assert gif.size == tuple(int(d * 20) for d in animate.fig_spec['figsize'])
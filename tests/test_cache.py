@@ -0,0 +1,40 @@
+import inspect
+
+import numpy as np
+
+from kmcGrid import plot, sample
+from kmcGrid.cache import SampleCache
+from kmcGrid.observables import calculate_msd
+from kmcGrid.trajectory import pack
+
+TIMES = [np.array([0., 1., 2.])]
+
+
+def test_cache_keys_on_trajectory_content():
+    cache = SampleCache()
+    assert sample.sample_msd((0, 0), [[(0, 0), (0, 1), (1, 0)]], TIMES, [3.], cache)[0, 0] == 1
+    assert sample.sample_msd((0, 0), [[(0, 0), (0, 1), (0, 2)]], TIMES, [3.], cache)[0, 0] == 4
+
+
+def test_cache_keys_on_function_identity():
+    cache = SampleCache()
+    packed = pack([[(0, 0), (0, 1), (0, 2)]], TIMES)
+    double = sample.sample_observable(packed, None, [3.], lambda s0, state_trajectory: 2 * calculate_msd(
+        s0, state_trajectory), {'s0': (0, 0)}, cache)
+    triple = sample.sample_observable(packed, None, [3.], lambda s0, state_trajectory: 3 * calculate_msd(
+        s0, state_trajectory), {'s0': (0, 0)}, cache)
+    assert (double[0, 0], triple[0, 0]) == (8, 12)
+
+
+def test_packed_stores_are_hashed_once_and_reused():
+    cache = SampleCache()
+    packed = pack([[(0, 0), (0, 1), (0, 2)]], TIMES)
+    assert packed._fingerprint is None
+    first = sample.sample_msd((0, 0), packed, None, [0.5, 3.], cache)
+    assert packed._fingerprint is not None
+    again = sample.sample_msd((0, 0), packed, None, [0.5, 3.], cache)
+    assert again is first and (cache.hits, cache.misses) == (1, 1)
+
+
+def test_plots_do_not_cache_unless_asked():
+    assert inspect.signature(plot.plot_mean_msd).parameters['cache'].default is None
@@ -0,0 +1,88 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from kmcGrid import kmc, parallel
+from kmcGrid.checkpoint import load_snapshot, save_snapshot
+from kmcGrid.lattice import SCLattice, TiledSCLattice
+
+from conftest import S0, TAU, make_lattice
+
+
+@pytest.mark.parametrize('rng', [np.random, np.random.default_rng(1), np.random.Generator(np.random.MT19937(1))])
+def test_snapshots_restore_random_state_without_pickle(tmp_path, rng):
+    path = str(tmp_path / 'state.npz')
+    rng.normal(size=3)
+    save_snapshot(path, rng, x=np.arange(3))
+    expected = rng.random(5)
+    with np.load(path, allow_pickle=False) as snapshot:
+        assert all(snapshot[name].dtype != object for name in snapshot.files)
+    arrays = load_snapshot(path, rng)
+    assert list(arrays) == ['x'] and np.array_equal(rng.random(5), expected)
+
+
+class _Payload:
+    loaded = False
+
+    def __reduce__(self):
+        return setattr, (_Payload, 'loaded', True)
+
+
+def test_snapshots_never_unpickle_random_state(tmp_path):
+    path = str(tmp_path / 'state.npz')
+    np.savez(path, rng_state=np.frombuffer(pickle.dumps(_Payload()), dtype=np.uint8))
+    with pytest.raises(ValueError):
+        load_snapshot(path, np.random.default_rng())
+    assert not _Payload.loaded
+
+
+def test_run_ensemble_resumes_bit_identically(tmp_path, monkeypatch):
+    lattice = make_lattice()
+    energy = lattice.energy.copy()
+    full = kmc.run_ensemble(S0, lattice, TAU, 40, np.random.default_rng(3), packed=True)
+
+    lockstep = kmc._lockstep
+
+    def interrupted(*args):
+        for i, hop in enumerate(lockstep(*args)):
+            yield hop
+            if i == 20:
+                raise KeyboardInterrupt
+
+    checkpoint = str(tmp_path / 'ensemble')
+    monkeypatch.setattr(kmc, '_lockstep', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        kmc.run_ensemble(S0, lattice, TAU, 40, np.random.default_rng(3), packed=True, checkpoint=checkpoint,
+                         checkpoint_every=-1.)
+    monkeypatch.setattr(kmc, '_lockstep', lockstep)
+
+    fresh = SCLattice((7, 7), 0.03, 1., 300.)
+    resumed = kmc.run_ensemble(S0, fresh, TAU, 40, np.random.default_rng(99), packed=True, checkpoint=checkpoint)
+    assert np.array_equal(fresh.energy, energy)
+    for name in ('offsets', 'times', 'sites'):
+        assert np.array_equal(getattr(resumed, name), getattr(full, name))
+
+
+def test_run_parallel_resumes_bit_identically(tmp_path):
+    lattice = make_lattice()
+    full = parallel.run_parallel(S0, lattice, TAU, 10, seed=7, n_workers=1)
+    checkpoint = str(tmp_path / 'parallel')
+    parallel.run_parallel(S0, lattice, TAU, 10, seed=7, n_workers=1, checkpoint=checkpoint)
+    # Forget all but the first four trajectories, as if the run had been killed
+    offsets = np.fromfile(str(tmp_path / 'parallel' / 'offsets.bin'), dtype='<i8')
+    offsets[:5].tofile(str(tmp_path / 'parallel' / 'offsets.bin'))
+    resumed = parallel.run_parallel(S0, make_lattice(), TAU, 10, n_workers=1, checkpoint=checkpoint)
+    states, times = resumed.to_lists()
+    assert states == full[0]
+    assert all(np.array_equal(a, b) for a, b in zip(times, full[1]))
+
+
+def test_run_parallel_resumes_tiled_landscape(tmp_path):
+    lattice = TiledSCLattice((12, 12), 0.03, 1., 300., (4, 4), seed=2**100 + 5)
+    checkpoint = str(tmp_path / 'tiled')
+    full = parallel.run_parallel((6, 6), lattice, TAU, 4, seed=1, n_workers=1, checkpoint=checkpoint)
+    fresh = TiledSCLattice((12, 12), 0.03, 1., 300., (4, 4), seed=0)
+    resumed = parallel.run_parallel((6, 6), fresh, TAU, 4, n_workers=1, checkpoint=checkpoint)
+    assert fresh.seed == lattice.seed
+    assert np.array_equal(resumed.sites, full.sites)
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from kmcGrid import kmc
+from kmcGrid.instrument import RunStats
+
+from conftest import S0, TAU, run_lists
+
+
+@pytest.mark.parametrize('time_phases', [False, True])
+def test_run_stats_count_hops_and_boundary_hops(lattice, time_phases):
+    (states,), (times,) = run_lists(lattice, 1)
+    stats = RunStats(time_phases=time_phases)
+    seen = []
+    instrumented, instrumented_times = kmc.run(S0, lattice, TAU, np.random.default_rng(0), stats=stats,
+                                               callback=seen.append)
+    assert instrumented == states and np.array_equal(instrumented_times, times)
+    # Sites on the grid edge have fewer than four neighbors
+    boundary = sum(1 for s in states[:-1] if 0 in s or 6 in s)
+    assert (stats.trajectories, stats.hops, stats.boundary_hops) == (1, len(states) - 1, boundary)
+    assert seen == [stats]
+    assert (sum(stats.phase_seconds.values()) > 0) == time_phases
+
+
+def test_callback_alone_only_counts(lattice):
+    seen = []
+    kmc.run(S0, lattice, TAU, np.random.default_rng(0), callback=seen.append)
+    assert len(seen) == 1 and not seen[0].time_phases and seen[0].trajectories == 1
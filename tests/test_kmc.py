@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from kmcGrid import kmc, sample
+from kmcGrid.instrument import RunStats
+from kmcGrid.lattice import TiledSCLattice
+from kmcGrid.observables import calculate_msd
+from kmcGrid.trajectory import PackedTrajectories
+
+from conftest import S0, TAU, TARGET_TIMES, run_lists
+
+
+def test_streamed_sampling_matches_sample_trajectories(lattice):
+    states, times = run_lists(lattice, 20)
+    streamed = np.array([kmc.run(S0, lattice, TAU, np.random.default_rng(k), TARGET_TIMES) for k in range(20)])
+    assert np.array_equal(sample.count_timed_states(streamed, lattice),
+                          sample.sample_trajectories(states, times, TARGET_TIMES, lattice))
+    assert np.array_equal(sample.sample_timed_observable(streamed, calculate_msd, {'s0': S0}),
+                          sample.sample_msd(S0, states, times, TARGET_TIMES))
+
+
+def test_ensemble_sampling_matches_packed_ensemble(lattice):
+    packed = kmc.run_ensemble(S0, lattice, TAU, 50, np.random.default_rng(1), packed=True)
+    streamed = kmc.run_ensemble(S0, lattice, TAU, 50, np.random.default_rng(1), TARGET_TIMES)
+    assert np.array_equal(np.swapaxes(streamed, 0, 1), packed.states_at(packed.sample_indices(TARGET_TIMES)))
+
+
+def test_periodic_streamed_sampling_follows_unwrapped_paths(periodic_lattice):
+    lattice = periodic_lattice
+    states, times = run_lists(lattice, 20)
+    streamed = np.array([kmc.run(S0, lattice, TAU, np.random.default_rng(k), TARGET_TIMES) for k in range(20)])
+    assert np.any((streamed < 0) | (streamed >= 7))
+    assert np.array_equal(sample.sample_timed_observable(streamed, calculate_msd, {'s0': S0}),
+                          sample.sample_msd(S0, states, times, TARGET_TIMES))
+
+
+def test_periodic_ensemble_sampling_follows_unwrapped_paths(periodic_lattice):
+    lattice = periodic_lattice
+    packed = kmc.run_ensemble(S0, lattice, TAU, 50, np.random.default_rng(1), packed=True)
+    streamed = kmc.run_ensemble(S0, lattice, TAU, 50, np.random.default_rng(1), TARGET_TIMES)
+    assert np.array_equal(np.swapaxes(streamed, 0, 1), packed.states_at(packed.sample_indices(TARGET_TIMES)))
+
+
+def test_tiled_lattice_runs_on_state_tuples():
+    lattice = TiledSCLattice((12, 12), 0.03, 1., 300., (4, 4), seed=1)
+    states, times = kmc.run((6, 6), lattice, TAU, np.random.default_rng(0))
+    assert len(states) == len(times) and all(0 <= c < 12 for s in states for c in s)
+    assert np.all(np.abs(np.diff(np.array(states), axis=0)).sum(axis=1) == 1)
+    sampled = kmc.run((6, 6), lattice, TAU, np.random.default_rng(0), TARGET_TIMES)
+    packed = PackedTrajectories.from_lists([states], [times], lattice.size)
+    assert np.array_equal(sampled, packed.states_at(packed.sample_indices(TARGET_TIMES))[:, 0])
+
+
+def test_tiled_landscape_is_reproducible_and_bounded():
+    lattice = TiledSCLattice(None, 0.03, 1., 300., (4, 4), seed=1, max_tiles=2)
+    energies = [lattice.energy_at(s) for s in ((0, 0), (-5, 3), (40, -40), (0, 0))]
+    assert lattice.n_tiles == 2 and energies[0] == energies[-1]
+    assert energies[1] == TiledSCLattice(None, 0.03, 1., 300., (4, 4), seed=1).energy_at((-5, 3))
+
+
+@pytest.mark.parametrize('mode', [{}, {'stats': RunStats()}, {'accelerate': object()}])
+def test_lattices_without_index_tables_reject_unsupported_modes(mode):
+    lattice = TiledSCLattice((12, 12), 0.03, 1., 300., (4, 4), seed=1)
+    with pytest.raises(AssertionError):
+        if mode:
+            kmc.run((6, 6), lattice, TAU, **mode)
+        else:
+            kmc.run_ensemble((6, 6), lattice, TAU, 10)
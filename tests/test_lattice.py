@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from kmcGrid.lattice import StencilLattice, k_B
+
+from conftest import make_lattice
+
+
+def test_neighbors_and_rates_follow_the_tables(lattice):
+    # Walls drop the -x and -y hops of the corner site; the rest keep the -1, +1 per axis order
+    assert lattice.get_neighbors((0, 0)) == [(1, 0), (0, 1)]
+    assert lattice.get_neighbors((3, 3)) == [(2, 3), (4, 3), (3, 2), (3, 4)]
+    expected = [np.exp((lattice.energy[3, 3] - lattice.energy[n]) / (k_B * lattice.temp))
+                for n in lattice.get_neighbors((3, 3))]
+    assert np.allclose(lattice.get_rates((3, 3)), expected)
+
+
+def test_wrap_table_matches_minimum_image_hops(periodic_lattice):
+    lattice = periodic_lattice
+    sites = np.repeat(np.arange(len(lattice.neighbor_table)), len(lattice.offsets))
+    ends = lattice.neighbor_table.ravel()
+    raw = lattice.index_to_coords(ends) - lattice.index_to_coords(sites)
+    wrap = lattice.wrap_table.reshape(-1, lattice.dim)
+    assert np.array_equal(raw + wrap, lattice.displacement(sites, ends))
+    assert np.any(wrap != 0)
+
+
+def rebuilt(lattice, temp, rate, std_energy):
+    """ Lattice built from scratch on the same standard normal landscape at the given parameters """
+    np.random.seed(0)
+    return StencilLattice(lattice.size, std_energy, rate, temp, boundary=lattice.boundary)
+
+
+@pytest.mark.parametrize('periodic', [False, True])
+def test_retarget_matches_a_rebuilt_lattice(periodic):
+    lattice = make_lattice(periodic)
+    lattice.retarget(temp=200., rate=3.)
+    assert np.allclose(lattice.cum_rates, rebuilt(lattice, 200., 3., 0.03).cum_rates, rtol=1e-12)
+    lattice.retarget(std_energy=0.05)
+    fresh = rebuilt(lattice, 200., 3., 0.05)
+    assert np.array_equal(lattice.energy, fresh.energy)
+    assert np.array_equal(lattice.cum_rates, fresh.cum_rates)
+
+
+def test_retarget_rescales_energies_set_by_hand(lattice):
+    lattice.energy = np.linspace(-0.1, 0.1, 49).reshape(7, 7)
+    lattice.build_tables()
+    lattice.retarget(std_energy=0.06)
+    assert np.allclose(lattice.energy, 2 * np.linspace(-0.1, 0.1, 49).reshape(7, 7))
+    assert np.allclose(np.diff(lattice.cum_rates, axis=1, prepend=0.)[24, 0],
+                       np.exp((lattice.energy[3, 3] - lattice.energy[2, 3]) / (k_B * 300.)))
+
+
+def naive_block_free_energy(energy, new_size, temp):
+    """ Mean-centred block free energies summed block by block with plain Boltzmann factors """
+    window = [s // n for s, n in zip(energy.shape, new_size)]
+    fe = np.empty(new_size)
+    for block in np.ndindex(*new_size):
+        sites = energy[tuple(slice(b * w, (b + 1) * w) for b, w in zip(block, window))]
+        fe[block] = -k_B * temp * np.log(np.sum(np.exp(-sites / (k_B * temp))))
+    return fe - np.mean(fe)
+
+
+@pytest.mark.parametrize('new_size', [(4, 3), (3, 5)])
+def test_coarse_grain_matches_naive_block_sums(new_size):
+    np.random.seed(2)
+    lattice = StencilLattice((8, 12), 0.05, 1., 300.)
+    expected = naive_block_free_energy(lattice.energy, new_size, lattice.temp)
+    lattice.coarse_grain(new_size)
+    assert lattice.size == new_size
+    assert lattice.neighbor_table.shape[0] == np.prod(new_size)
+    assert np.allclose(lattice.energy, expected)
+
+
+def test_coarse_grain_survives_large_barriers():
+    np.random.seed(2)
+    lattice = StencilLattice((8, 12), 0.05, 1., 300.)
+    # Barriers of ~200 kT would overflow plain Boltzmann factors
+    lattice.energy = lattice.energy * 100.
+    lowest = lattice.energy.reshape(4, 2, 3, 4).min(axis=(1, 3))
+    lattice.coarse_grain((4, 3))
+    # Each block free energy is then set by its lowest site, less at most kT log(sites per block)
+    assert np.all(np.isfinite(lattice.energy))
+    assert np.allclose(lattice.energy, lowest - np.mean(lowest), atol=k_B * 300. * np.log(8))
+
+
+def test_coarse_grain_pyramid_matches_sequential_coarse_grain():
+    np.random.seed(3)
+    lattice = StencilLattice((8, 12), 0.05, 1., 300.)
+    energy = lattice.energy.copy()
+    levels = lattice.coarse_grain_pyramid([(4, 6), (2, 3)])
+    assert np.array_equal(lattice.energy, energy)
+    for level in levels:
+        lattice.coarse_grain(level.shape)
+        assert np.allclose(level, lattice.energy)
@@ -0,0 +1,54 @@
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+from kmcGrid.lattice import SCLattice, k_B
+from kmcGrid.manybody import FenwickTree, run_exclusion
+
+
+def test_fenwick_tree_prefix_sums_and_selection():
+    rng = np.random.default_rng(0)
+    weights = rng.random(37)
+    weights[[3, 20]] = 0.
+    tree = FenwickTree(weights)
+    tree.update(5, 2.5)
+    weights[5] = 2.5
+    cumulative = np.concatenate(([0.], np.cumsum(weights)))
+    assert np.allclose([tree.prefix(i) for i in range(38)], cumulative)
+    for u in rng.random(200) * tree.total:
+        assert tree.find(u) == np.searchsorted(cumulative, u, side='right') - 1
+
+
+def exact_occupancy(lattice, n_particles):
+    """ Site occupancy of the exclusion process at equilibrium, summed over every configuration """
+    # Hops i -> j go at rate * exp((E_i - E_j) / kT), so detailed balance weighs a site by exp(-2 E / kT)
+    boltzmann = np.exp(-2 * lattice.energy.ravel() / (k_B * lattice.temp))
+    occupancy = np.zeros(len(boltzmann))
+    for sites in combinations(range(len(boltzmann)), n_particles):
+        occupancy[list(sites)] += np.prod(boltzmann[list(sites)])
+    return occupancy * n_particles / occupancy.sum()
+
+
+def test_exclusion_reaches_the_exact_stationary_occupancy():
+    np.random.seed(2)
+    lattice = SCLattice((3, 3), 0.03, 1., 300.)
+    initial_states = [(0, 0), (1, 1), (2, 2)]
+    tau = 16000.
+    packed = run_exclusion(initial_states, lattice, tau, np.random.default_rng(3))
+    # Time each site was held by any particle, from every particle's hops
+    held = np.zeros(9)
+    for p in range(len(packed)):
+        start, end = packed.offsets[p], packed.offsets[p + 1]
+        np.add.at(held, packed.sites[start:end - 1], np.diff(packed.times[start:end]))
+    assert np.allclose(held / tau, exact_occupancy(lattice, 3), atol=0.025)
+
+
+def test_exclusion_never_puts_two_particles_on_a_site(lattice):
+    initial_states = [(0, 0), (0, 1), (1, 0), (3, 3)]
+    packed = run_exclusion(initial_states, lattice, 20., np.random.default_rng(4))
+    targets = np.linspace(0., 20., 41)
+    sites = packed.sites_at(packed.sample_indices(targets))
+    assert all(len(set(row)) == len(initial_states) for row in sites.tolist())
+    with pytest.raises(AssertionError):
+        run_exclusion([(0, 0), (0, 0)], lattice, 1.)
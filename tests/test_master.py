@@ -0,0 +1,42 @@
+import numpy as np
+from scipy.linalg import expm
+
+from kmcGrid import kmc, master, sample
+from kmcGrid.lattice import SCLattice
+
+from conftest import S0
+
+
+def dense_propagate(s0, lattice, target_times):
+    """ Populations from the dense matrix exponential of the generator at every target time """
+    generator = master.rate_matrix(lattice).toarray()
+    p = np.zeros(len(generator))
+    p[lattice.state_to_index(s0)] = 1.
+    return np.array([expm(generator * t) @ p for t in target_times]).reshape((-1,) + lattice.size)
+
+
+def test_propagate_matches_dense_exponential(lattice):
+    for target_times in ([0., 0.5, 1., 1.5], [0.2, 0.3, 1.7]):
+        assert np.allclose(master.propagate(S0, lattice, target_times), dense_propagate(S0, lattice, target_times),
+                           atol=1e-10)
+
+
+def test_unevenly_spaced_fine_grid_is_not_treated_as_even():
+    np.random.seed(1)
+    lattice = SCLattice((5, 5), 0.03, 1e9, 300.)
+    target_times = [0., 1e-9, 5e-9]
+    assert np.allclose(master.propagate((2, 2), lattice, target_times),
+                       dense_propagate((2, 2), lattice, target_times), atol=1e-10)
+
+
+def test_master_equation_agrees_with_ensemble(lattice):
+    n_walkers = 4000
+    target_times = np.array([1., 4.])
+    packed = kmc.run_ensemble(S0, lattice, 4., n_walkers, np.random.default_rng(6), packed=True)
+    populations = sample.sample_trajectories(packed, None, target_times, lattice) / n_walkers
+    exact = master.propagate(S0, lattice, target_times)
+    # Five standard errors of a binomial proportion
+    assert np.all(np.abs(populations - exact) <= 5 * np.sqrt(exact * (1 - exact) / n_walkers) + 1e-3)
+    msd = sample.sample_msd(S0, packed, None, target_times)
+    sem = np.std(msd, axis=1) / np.sqrt(n_walkers)
+    assert np.all(np.abs(np.mean(msd, axis=1) - master.mean_msd(S0, lattice, target_times)) <= 5 * sem)
@@ -0,0 +1,14 @@
+import numpy as np
+
+from kmcGrid.observables import window_slope
+
+
+def test_window_slope_matches_least_squares():
+    rng = np.random.default_rng(8)
+    # Large x offsets would lose precision in uncentred running sums
+    x = np.linspace(1e4, 1e4 + 10., 60)
+    y = 3 * x[:, None] + rng.random((60, 2))
+    expected = [np.polyfit(x[i:i + 12], y[i:i + 12], 1)[0] for i in range(60 - 12)]
+    assert np.allclose(window_slope(x, y, 12), expected)
+    assert np.allclose(window_slope(x, y[:, 0], 12), np.array(expected)[:, 0])
+    assert window_slope(x[:5], y[:5], 12).shape == (0, 2)
@@ -0,0 +1,23 @@
+import numpy as np
+
+from kmcGrid import parallel
+
+from conftest import S0, TAU, TARGET_TIMES, make_lattice
+
+
+def test_parallel_runs_do_not_depend_on_worker_count():
+    lattice = make_lattice()
+    one = parallel.run_parallel(S0, lattice, TAU, 12, seed=5, n_workers=1, shuffle=True)
+    two = parallel.run_parallel(S0, lattice, TAU, 12, seed=5, n_workers=2, shuffle=True, chunk_size=5)
+    assert one[0] == two[0]
+    assert all(np.array_equal(a, b) for a, b in zip(one[1], two[1]))
+    sampled = parallel.run_parallel(S0, lattice, TAU, 12, seed=5, n_workers=2, shuffle=True,
+                                    target_times=TARGET_TIMES)
+    assert sampled.shape == (12, len(TARGET_TIMES), 2)
+
+
+def test_shuffled_serial_runs_leave_the_caller_lattice_alone(lattice):
+    energy = lattice.energy.copy()
+    parallel.run_parallel(S0, lattice, TAU, 4, seed=5, n_workers=1, shuffle=True)
+    assert np.array_equal(lattice.energy, energy)
+    assert parallel._worker_lattice is None
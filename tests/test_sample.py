@@ -0,0 +1,25 @@
+import numpy as np
+
+from kmcGrid.trajectory import PackedTrajectories
+
+from conftest import TARGET_TIMES, run_lists
+
+
+def naive_sample(states, times, target_times):
+    """ State before the first hop at or after each target time, or the last state past the end """
+    sampled = []
+    for t in target_times:
+        row = []
+        for s, ts in zip(states, times):
+            later = np.flatnonzero(ts >= t)
+            row.append(s[max(later[0] - 1, 0)] if later.size > 0 else s[-1])
+        sampled.append(row)
+    return np.array(sampled)
+
+
+def test_sample_indices_match_naive_scan(lattice):
+    states, times = run_lists(lattice, 20)
+    packed = PackedTrajectories.from_lists(states, times, lattice.size)
+    expected = naive_sample(states, times, TARGET_TIMES)
+    assert np.array_equal(packed.states_at(packed.sample_indices(TARGET_TIMES)), expected)
+    assert np.array_equal(packed.states_at(packed.sample_indices(TARGET_TIMES, chunk_size=3)), expected)
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from kmcGrid import kmc, sample
+from kmcGrid.observables import calculate_msd
+from kmcGrid.statistics import OccupancyAccumulator, PopulationCounter, RunningHistogram, RunningMoments
+
+from conftest import S0, TAU, TARGET_TIMES, make_lattice, run_lists
+
+
+def msd_samples(lattice, n_traj=60):
+    """ Seeded ensemble MSD samples at TARGET_TIMES with shape (n_targets, n_traj) """
+    timed = kmc.run_ensemble(S0, lattice, TAU, n_traj, np.random.default_rng(5), TARGET_TIMES)
+    return sample.sample_timed_observable(timed, calculate_msd, {'s0': S0})
+
+
+def test_running_moments_match_batch_statistics(lattice):
+    samples = msd_samples(lattice)
+    single = RunningMoments(len(TARGET_TIMES))
+    for column in samples.T:
+        single.add(column)
+    merged = RunningMoments(len(TARGET_TIMES))
+    for part in np.array_split(samples, [7, 30], axis=1):
+        batch = RunningMoments(len(TARGET_TIMES))
+        batch.add(part)
+        merged.merge(batch)
+    for moments in (single, merged):
+        assert moments.count == 60
+        assert np.allclose(moments.mean, np.mean(samples, axis=1))
+        assert np.allclose(moments.variance, np.var(samples, axis=1, ddof=1))
+        assert np.allclose(moments.sem, np.std(samples, axis=1, ddof=1) / np.sqrt(60))
+
+
+def test_running_histogram_matches_np_histogram(lattice):
+    samples = msd_samples(lattice)
+    bins = np.array([0., 1., 2., 5., 10., 20.])
+    histogram = RunningHistogram(len(TARGET_TIMES), bins)
+    other = RunningHistogram(len(TARGET_TIMES), bins)
+    histogram.add(samples[:, :25])
+    other.add(samples[:, 25:])
+    histogram.merge(other)
+    for counts, density, row in zip(histogram.counts, histogram.density(), samples):
+        assert np.array_equal(counts, np.histogram(row, bins)[0])
+        if counts.sum() > 0:
+            assert np.allclose(density, np.histogram(row, bins, density=True)[0])
+
+
+def test_population_counter_matches_sample_counts(periodic_lattice):
+    timed = kmc.run_ensemble(S0, periodic_lattice, TAU, 40, np.random.default_rng(6), TARGET_TIMES)
+    counter = PopulationCounter(len(TARGET_TIMES), periodic_lattice.size)
+    counter.add(timed[:10])
+    other = PopulationCounter(len(TARGET_TIMES), periodic_lattice.size)
+    for states in timed[10:]:
+        other.add(states)
+    counter.merge(other)
+    assert counter.count == 40
+    assert np.array_equal(counter.counts, sample.count_timed_states(timed, periodic_lattice))
+    assert np.allclose(counter.populations().sum(axis=(1, 2)), 1.)
+
+
+@pytest.mark.parametrize('periodic', [False, True])
+def test_occupancy_matches_sample_trajectories(periodic):
+    lattice = make_lattice(periodic)
+    states, times = run_lists(lattice, 20)
+    occupancy = OccupancyAccumulator(TARGET_TIMES, lattice.size)
+    for k in range(20):
+        kmc.run(S0, lattice, TAU, np.random.default_rng(k), occupancy=occupancy)
+    assert np.array_equal(occupancy.counts, sample.sample_trajectories(states, times, TARGET_TIMES, lattice))
+    assert occupancy.dwell.sum() == pytest.approx(20 * TAU)
+
+
+@pytest.mark.parametrize('periodic', [False, True])
+def test_ensemble_occupancy_matches_sample_trajectories(periodic):
+    lattice = make_lattice(periodic)
+    packed = kmc.run_ensemble(S0, lattice, TAU, 50, np.random.default_rng(2), packed=True)
+    occupancy = kmc.run_ensemble(S0, lattice, TAU, 50, np.random.default_rng(2),
+                                 occupancy=OccupancyAccumulator(TARGET_TIMES, lattice.size))
+    assert np.array_equal(occupancy.counts, sample.sample_trajectories(packed, None, TARGET_TIMES, lattice))
+    # Dwell time on each site is the time between arriving there and the next hop
+    dwell = np.zeros(49)
+    for i in range(len(packed)):
+        start, end = packed.offsets[i], packed.offsets[i + 1]
+        np.add.at(dwell, packed.sites[start:end - 1], np.diff(packed.times[start:end]))
+    assert np.allclose(occupancy.flat_dwell, dwell)
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from kmcGrid import kmc, master, sample
+from kmcGrid.lattice import SCLattice
+from kmcGrid.superbasin import TrapAccelerator
+
+
+def two_site_trap():
+    """ Flat 7x7 lattice with a deep two-site trap at (3, 3) and (3, 4) """
+    lattice = SCLattice((7, 7), 0., 1., 300.)
+    lattice.energy = np.zeros((7, 7))
+    lattice.energy[3, 3] = lattice.energy[3, 4] = -0.1
+    lattice.build_tables()
+    return lattice
+
+
+def test_accelerated_sampling_agrees_with_master_equation():
+    lattice = two_site_trap()
+    n_walkers = 800
+    target_times = np.array([20., 60.])
+    accelerator = TrapAccelerator(lattice, window=16)
+    rng = np.random.default_rng(7)
+    sampled = np.array([kmc.run((3, 3), lattice, 60., rng, target_times, accelerate=accelerator)
+                        for _ in range(n_walkers)])
+    populations = sample.count_timed_states(sampled, lattice) / n_walkers
+    exact = master.propagate((3, 3), lattice, target_times)
+    assert accelerator.basins_exited > 0
+    # Five standard errors of a binomial proportion
+    assert np.all(np.abs(populations - exact) <= 5 * np.sqrt(exact * (1 - exact) / n_walkers) + 1e-3)
+
+
+def test_accelerated_runs_need_target_times():
+    lattice = two_site_trap()
+    with pytest.raises(AssertionError):
+        kmc.run((3, 3), lattice, 60., np.random.default_rng(0), accelerate=TrapAccelerator(lattice))
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from kmcGrid import sweep
+
+POINTS = sweep.parameter_grid([0.01, 0.03, 0.07], [300., 200.], [1.], [(9, 9)])
+TARGET_TIMES = np.linspace(0., 5., 6)
+
+
+@pytest.fixture
+def worker_lattice():
+    yield sweep._worker_lattice
+    sweep._worker_lattice.clear()
+
+
+def test_retargeted_lattice_matches_a_fresh_one(worker_lattice):
+    landscape_seed = np.random.SeedSequence(4)
+    for point in POINTS[1:]:
+        worker_lattice.clear()
+        fresh = sweep._point_lattice(point, landscape_seed)
+        worker_lattice.clear()
+        sweep._point_lattice(POINTS[0], landscape_seed)
+        retargeted = sweep._point_lattice(point, landscape_seed)
+        assert retargeted is worker_lattice['lattice'] and retargeted is not fresh
+        assert np.array_equal(retargeted.energy, fresh.energy)
+        assert np.array_equal(retargeted.cum_rates, fresh.cum_rates)
+
+
+@pytest.mark.parametrize('common_random_numbers', [False, True])
+def test_sweeps_do_not_depend_on_worker_count(common_random_numbers):
+    results = [sweep.run_sweep(POINTS, 5., 12, TARGET_TIMES, seed=3, n_workers=n, chunk_size=4, shuffle=False,
+                               common_random_numbers=common_random_numbers) for n in (1, 3)]
+    for i in range(len(POINTS)):
+        assert np.array_equal(results[0].mean_msd(i), results[1].mean_msd(i))
+        assert np.array_equal(results[0].sem_msd(i), results[1].sem_msd(i))
+    assert results[0].label(0) == 'std_energy=0.01, temp=300'
+
+
+def test_common_random_numbers_replay_the_same_trajectories_at_every_point():
+    twins = sweep.parameter_grid([0.03, 0.03], [300.], [1.], [(9, 9)])
+    paired, independent = [sweep.run_sweep(twins, 5., 20, TARGET_TIMES, seed=3, n_workers=1,
+                                           common_random_numbers=crn) for crn in (True, False)]
+    assert np.array_equal(paired.mean_msd(0), paired.mean_msd(1))
+    assert not np.array_equal(independent.mean_msd(0), independent.mean_msd(1))
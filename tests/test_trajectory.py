@@ -0,0 +1,76 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from kmcGrid import kmc, sample
+from kmcGrid.trajectory import TrajectoryWriter, open_store
+
+from conftest import S0, TAU, TARGET_TIMES, make_lattice, run_lists
+
+
+@pytest.mark.parametrize('periodic', [False, True])
+def test_compact_run_matches_plain_run(periodic):
+    lattice = make_lattice(periodic)
+    states, times = run_lists(lattice, 10)
+    compact, compact_times = run_lists(lattice, 10, compact=True)
+    for s, c, t, ct in zip(states, compact, times, compact_times):
+        assert list(c) == s
+        assert c[len(c) // 2] == s[len(s) // 2]
+        assert np.array_equal(t, ct)
+    assert np.array_equal(sample.sample_msd(S0, compact, compact_times, TARGET_TIMES),
+                          sample.sample_msd(S0, states, times, TARGET_TIMES))
+
+
+def test_compact_run_holds_no_spare_capacity(lattice):
+    (trajectory,), (times,) = run_lists(lattice, 1, compact=True)
+    # Sites of a 7x7 lattice fit in one byte and times take eight
+    assert trajectory.sites.base.nbytes == len(trajectory)
+    assert times.base.nbytes == 8 * len(trajectory)
+
+
+def test_periodic_indexing_keeps_no_unwrapped_copy(periodic_lattice):
+    (trajectory,), _ = run_lists(periodic_lattice, 1, tau=200., compact=True)
+    (path,), _ = run_lists(periodic_lattice, 1, tau=200.)
+    tracemalloc.start()
+    middle = trajectory[len(path) // 2]
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert middle == path[len(path) // 2] and (trajectory[0], trajectory[-1]) == (path[0], path[-1])
+    assert held < trajectory.nbytes
+
+
+def test_float32_times_round_the_plain_run_times(lattice):
+    (_,), (times,) = run_lists(lattice, 1)
+    (trajectory,), (compact_times,) = run_lists(lattice, 1, compact=True, time_dtype=np.float32)
+    assert compact_times.dtype == np.float32
+    assert np.array_equal(compact_times, times.astype(np.float32))
+
+
+@pytest.mark.parametrize('periodic', [False, True])
+def test_slices_are_lists_of_state_tuples(periodic):
+    lattice = make_lattice(periodic)
+    (path,), _ = run_lists(lattice, 1)
+    (trajectory,), _ = run_lists(lattice, 1, compact=True)
+    assert trajectory[:3] == path[:3]
+    assert trajectory[-4::2] == path[-4::2]
+
+
+@pytest.mark.parametrize('periodic', [False, True])
+def test_trajectory_store_round_trip(tmp_path, periodic):
+    lattice = make_lattice(periodic)
+    packed = kmc.run_ensemble(S0, lattice, TAU, 30, np.random.default_rng(4), packed=True)
+    path = str(tmp_path / 'store')
+    bounds = packed.offsets
+    with TrajectoryWriter(path, lattice.size, periodic=periodic) as writer:
+        for i in range(12):
+            writer.append(packed.sites[bounds[i]:bounds[i + 1]], packed.times[bounds[i]:bounds[i + 1]])
+    with TrajectoryWriter(path, mode='a') as writer:
+        for i in range(12, 30):
+            writer.append(packed.sites[bounds[i]:bounds[i + 1]], packed.times[bounds[i]:bounds[i + 1]])
+    store = open_store(path, chunk_size=7)
+    assert len(store) == 30
+    assert np.array_equal(sample.sample_msd(S0, store, None, TARGET_TIMES),
+                          sample.sample_msd(S0, packed, None, TARGET_TIMES))
+    # Chunked sampling reads the memory-mapped sites without materialising the states
+    assert store._states is None